@@ -0,0 +1,116 @@
+"""Decode benchmark of recorded Trakt and Torrentio payloads
+
+Decodes every recorded Trakt and Torrentio JSON response with the old
+SimpleNamespace object hook and as plain dicts, and reports decode time and
+memory held by the decoded data. Record payloads by calling
+utils.request.enable_recording(path) before running the program. Without a
+recording, one is made against the local stub server.
+
+    python benchmarks/json_decode.py [recording.jsonl]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from utils import request, stubs  # noqa: E402
+
+HOSTS = {"api.trakt.tv": "trakt", "torrentio.strem.fun": "torrentio"}
+TORRENTIO_URL = "https://torrentio.strem.fun/sort=qualitysize%7Cqualityfilter=480p,scr,cam"
+REPEATS = 20
+
+
+def record(filename: str):
+    """Record Trakt seasons and Torrentio streams answered by the stub server"""
+    server = stubs.StubServer(streams_per_item=200).start()
+    request.set_host_overrides(server.host_overrides())
+    request.enable_recording(filename)
+    try:
+        for number in range(1, 21):
+            imdb_id = f"tt{number}"
+            if number % 2:
+                request.get(
+                    f"https://api.trakt.tv/shows/{imdb_id}/seasons?extended=episodes,full",
+                    response_type=dict,
+                )
+                url = f"{TORRENTIO_URL}/stream/show/{imdb_id}:1:1.json"
+            else:
+                url = f"{TORRENTIO_URL}/stream/movie/{imdb_id}.json"
+            request.get(url, response_type=dict)
+    finally:
+        request.disable_record_replay()
+        request.set_host_overrides({})
+        server.stop()
+
+
+def load_payloads(filename: str) -> dict:
+    """Recorded JSON bodies by service"""
+    payloads = {service: [] for service in HOSTS.values()}
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            service = HOSTS.get(urlsplit(entry["url"]).netloc)
+            if service and entry["status_code"] == 200:
+                payloads[service].append(base64.b64decode(entry["content"]))
+    return payloads
+
+
+def decode_namespace(content: bytes):
+    return json.loads(content, object_hook=lambda item: SimpleNamespace(**item))
+
+
+def decode_dict(content: bytes):
+    return json.loads(content)
+
+
+def measure(decode, payloads: list) -> tuple:
+    """Seconds per decode and bytes held by one decoded set of payloads"""
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        for content in payloads:
+            decode(content)
+    elapsed = (time.perf_counter() - start_time) / REPEATS / len(payloads)
+    tracemalloc.start()
+    decoded = [decode(content) for content in payloads]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del decoded
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("recording", nargs="?")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = args.recording
+        if filename is None:
+            filename = os.path.join(directory, "recording.jsonl")
+            record(filename)
+        payloads = load_payloads(filename)
+
+    for service, contents in payloads.items():
+        if not contents:
+            print(f"{service}: nothing recorded")
+            continue
+        size = sum(map(len, contents)) / len(contents)
+        print(f"{service}: {len(contents)} payloads, {size / 1024:.0f} KiB on average")
+        for name, decode in [("SimpleNamespace", decode_namespace), ("dict", decode_dict)]:
+            elapsed, held = measure(decode, contents)
+            print(
+                f"  {name:<16} {elapsed * 1000:.2f} ms per decode,"
+                f" {held / len(contents) / 1024:.0f} KiB held per payload"
+            )
+
+
+if __name__ == "__main__":
+    main()
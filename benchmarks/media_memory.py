@@ -0,0 +1,127 @@
+"""Memory benchmark of media items on a synthetic library
+
+Builds shows with seasons and episodes like a large Plex library and reports
+the memory held per episode, and how long pickling, JSON encoding and saving
+the library to a media store take. Memory is measured again after the save
+and encode, which must not grow the items.
+
+    python benchmarks/media_memory.py --episodes 200000
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from program.media import (  # noqa: E402
+    Episode,
+    MediaItemContainer,
+    MediaItemState,
+    Season,
+    Show,
+)
+from program.store import MediaStore  # noqa: E402
+from utils.ui_helpers import CustomJSONEncoder  # noqa: E402
+
+EPISODES_PER_SEASON = 20
+SEASONS_PER_SHOW = 5
+
+
+def build_library(episodes: int) -> list:
+    """Shows holding the given amount of library episodes"""
+    shows = []
+    number = 0
+    while number < episodes:
+        show_number = len(shows)
+        show = Show(
+            {
+                "title": f"Show {show_number}",
+                "imdb_id": f"tt{show_number:07d}",
+                "aired_at": "2020-01-01:00",
+                "genres": ["drama"],
+                "locations": [f"Show {show_number}"],
+                "key": f"/library/metadata/{show_number}",
+            }
+        )
+        for season_number in range(1, SEASONS_PER_SHOW + 1):
+            season = Season({"number": season_number, "state": MediaItemState.LIBRARY})
+            for episode_number in range(1, EPISODES_PER_SEASON + 1):
+                if number == episodes:
+                    break
+                season.add_episode(
+                    Episode(
+                        {
+                            "number": episode_number,
+                            "title": f"Episode {episode_number}",
+                            "aired_at": "2020-01-01:00",
+                            "key": f"/library/metadata/{show_number}/{number}",
+                            "file_name": f"Show.{show_number}.S{season_number:02d}"
+                            f"E{episode_number:02d}.1080p.WEB.x264-GRP.mkv",
+                        }
+                    )
+                )
+                number += 1
+            show.add_season(season)
+        shows.append(show)
+    return shows
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def save(shows: list, directory: str):
+    """Save shows to a new media store and write them to the database"""
+    container = MediaItemContainer()
+    container.extend(shows)
+    store = MediaStore(os.path.join(directory, "media.db"))
+    store.save(container)
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--episodes", type=int, default=200000)
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    shows, build_time = timed(build_library, args.episodes)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+
+    episodes = [
+        episode for show in shows for season in show.seasons for episode in season.episodes
+    ]
+    _, pickle_time = timed(pickle.dumps, episodes, pickle.HIGHEST_PROTOCOL)
+    # Only allocations made from here on and still held count as growth
+    tracemalloc.start()
+    _, json_time = timed(json.dumps, shows, cls=CustomJSONEncoder)
+    with tempfile.TemporaryDirectory() as directory:
+        _, save_time = timed(save, shows, directory)
+    gc.collect()
+    grown = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"episodes          {len(episodes)} in {len(shows)} shows")
+    print(f"build             {build_time:.2f}s")
+    print(f"memory            {memory / 2**20:.1f} MiB, {memory / len(episodes):.0f} bytes per episode")
+    print(f"episode object    {sys.getsizeof(episodes[0])} bytes without its strings")
+    print(f"pickle episodes   {pickle_time:.2f}s")
+    print(f"json encode shows {json_time:.2f}s")
+    print(f"store save        {save_time:.2f}s")
+    print(f"memory growth     {grown / 2**20:.1f} MiB after encode and save, {grown / len(episodes):.0f} bytes per episode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Latency benchmark of pooled sessions against a local HTTPS server
+
+Compares utils.request, which keeps connections alive in per host sessions,
+with a new session per request like utils.request used before. Needs the
+openssl command to create a self-signed certificate.
+
+    python benchmarks/request_pool.py --requests 300
+"""
+import argparse
+import http.server
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from utils import request  # noqa: E402
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        content = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory: str) -> str:
+    """Serve HTTPS on localhost with a new self-signed certificate, return its url"""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+            "-keyout", key, "-out", cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    server = http.server.ThreadingHTTPServer(("localhost", 0), _Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Both clients verify the certificate through the environment
+    os.environ["REQUESTS_CA_BUNDLE"] = cert
+    return f"https://localhost:{server.server_address[1]}/"
+
+
+def get_with_new_session(url: str):
+    """GET the way utils.request did before sessions were pooled"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=Retry(total=5)))
+    try:
+        return session.get(url, timeout=5)
+    finally:
+        session.close()
+
+
+def measure(get, url: str, amount: int) -> float:
+    get(url)
+    start_time = time.perf_counter()
+    for _ in range(amount):
+        get(url)
+    return (time.perf_counter() - start_time) / amount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = start_server(directory)
+        new_session = measure(get_with_new_session, url, args.requests)
+        pooled = measure(request.get, url, args.requests)
+    print(f"new session per request {new_session * 1000:.2f} ms")
+    print(f"pooled session          {pooled * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
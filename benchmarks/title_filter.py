@@ -0,0 +1,163 @@
+"""Benchmark of the Torrentio title filter on release names
+
+Filters the stream titles in release_titles.txt, or the Torrentio responses of
+a recording made with utils.request.enable_recording(path), for movies,
+seasons and episodes. Reports the time per title of the regex checks the
+Torrentio scraper used before, of the first parse with program.parser and of
+a cached parse, and checks that both accept the same titles.
+
+    python benchmarks/title_filter.py [recording.jsonl]
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from program import parser as title_parser  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "release_titles.txt")
+ITEM_TYPES = ("movie", "season", "episode")
+REPEATS = 50
+
+
+def load_corpus(filename: str) -> list:
+    """Stream titles of the corpus, which are separated by blank lines"""
+    with open(filename, encoding="utf-8") as file:
+        blocks = file.read().split("\n\n")
+    return [
+        block.strip("\n")
+        for block in blocks
+        if block.strip() and not block.startswith("#")
+    ]
+
+
+def load_recording(filename: str) -> list:
+    """Stream titles of the recorded Torrentio responses"""
+    titles = []
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            if urlsplit(entry["url"]).netloc != "torrentio.strem.fun":
+                continue
+            if entry["status_code"] != 200:
+                continue
+            content = json.loads(base64.b64decode(entry["content"]))
+            titles += [stream["title"] for stream in content.get("streams", [])]
+    return titles
+
+
+def old_filter(item_type: str, title: str):
+    """Title and seeds if the title fits item_type, the way api_scrape did before"""
+    complete_title = title.split("\n👤")[0]
+    folder = complete_title.split("\n")[0]
+    file = complete_title.split("\n")[-1]
+    if not _old_matches_formatting(item_type, file, folder):
+        return None
+    seeds = re.search(r"👤\s*(\d*)\s*💾", title).group(1)
+    return complete_title, int(seeds or 0)
+
+
+def _old_matches_formatting(item_type: str, file: str, folder: str) -> bool:
+    if not _old_matches_rclone_formatting(item_type, file, folder):
+        return False
+
+    def match_folder(folder: str):
+        season_pattern = r"(S\d{2}|Season \d{1,2})"
+        episode_pattern = r"(E\d{1,2}|Episode \d{1,2})"
+        matches = re.finditer(season_pattern, folder, re.IGNORECASE)
+        return [
+            match.group()
+            for match in matches
+            if not re.search(episode_pattern, folder[match.start():])
+        ]
+
+    match item_type:
+        case "movie":
+            pattern = r"^(?:(?!Season|Episode|Collection|S\d{1,2}|E\d{1,2}).)*$"
+            return len(re.findall(pattern, file, re.IGNORECASE)) > 0
+        case "season":
+            return len(match_folder(folder)) > 0
+        case "episode":
+            if len(match_folder(folder)) == 0:
+                return False
+            pattern = r"(S\d{1,2}|Season \d{1,2}).*(E\d{1,2}|Episode \d{1,2})"
+            return len(re.findall(pattern, file, re.IGNORECASE)) > 0
+        case _:
+            return False
+
+
+def _old_matches_rclone_formatting(item_type: str, file: str, folder: str) -> bool:
+    matching_string = file
+    match item_type:
+        case "movie":
+            pattern = r"(19|20)([0-9]{2} ?\.?)"
+        case _:
+            pattern = r"(S[0-9]{2}|SEASON|COMPLETE|[^457a-z\W\s]-[0-9]+)"
+            matching_string = folder
+    return len(re.findall(pattern, matching_string, re.IGNORECASE)) > 0
+
+
+def new_filter(item_type: str, titles: list) -> list:
+    return [
+        parsed.title
+        for parsed in title_parser.match_titles(item_type, titles)
+        if parsed.accepted
+    ]
+
+
+def measure(function, *args) -> float:
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        function(*args)
+    return (time.perf_counter() - start_time) / REPEATS
+
+
+def measure_cold(item_type: str, titles: list) -> float:
+    elapsed = 0
+    for _ in range(REPEATS):
+        title_parser.match_title.cache_clear()
+        start_time = time.perf_counter()
+        new_filter(item_type, titles)
+        elapsed += time.perf_counter() - start_time
+    return elapsed / REPEATS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("recording", nargs="?")
+    args = parser.parse_args()
+
+    if args.recording:
+        titles = load_recording(args.recording)
+    else:
+        titles = load_corpus(CORPUS)
+    print(f"{len(titles)} titles")
+
+    for item_type in ITEM_TYPES:
+        old_accepted = [
+            result[0]
+            for result in (old_filter(item_type, title) for title in titles)
+            if result
+        ]
+        new_accepted = new_filter(item_type, titles)
+        if old_accepted != new_accepted:
+            print(f"{item_type}: accepted titles differ")
+        old = measure(lambda: [old_filter(item_type, title) for title in titles])
+        cold = measure_cold(item_type, titles)
+        warm = measure(new_filter, item_type, titles)
+        print(
+            f"{item_type:<8} {len(new_accepted):>4} accepted,"
+            f" old {old / len(titles) * 1e6:.1f}us,"
+            f" first parse {cold / len(titles) * 1e6:.1f}us,"
+            f" cached {warm / len(titles) * 1e6:.1f}us per title"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 """ Program controller """
-from copy import copy
 from flask import Blueprint, request
 from program.media import MediaItemState
+from utils.metrics import request_metrics
 from utils.settings import settings_manager
 
 
@@ -17,6 +17,10 @@ class ProgramController(Blueprint):
         # self.register_blueprint(self.DebridController(self.program.debrid_instances))
         self.add_url_rule("/items", methods=["GET"], view_func=self.get_items)
         self.add_url_rule("/states", methods=["GET"], view_func=self.get_states)
+        self.add_url_rule(
+            "/states/count", methods=["GET"], view_func=self.get_state_counts
+        )
+        self.add_url_rule("/metrics", methods=["GET"], view_func=self.get_metrics)
         self.add_url_rule(
             "/items/remove",
             methods=["POST"],
@@ -29,21 +33,30 @@ class ProgramController(Blueprint):
         state = request.args.get("state")
 
         if state:
-            items = [
-                item for item in self.program.media_items if item.state.name == state
-            ]
+            items = []
+            if state in MediaItemState.__members__:
+                items = self.program.media_items.get_items_with_state(
+                    MediaItemState[state]
+                )
         else:
             items = self.program.media_items.items
-
-        new_items = copy(items)
-        for item in new_items:
-            item.set("current_state", item.state.name)
         return items
 
     def get_states(self):
         """states endpoint"""
         return [state.name for state in MediaItemState]
 
+    def get_state_counts(self):
+        """state counts endpoint"""
+        return {
+            state.name: count
+            for state, count in self.program.media_items.count_by_state().items()
+        }
+
+    def get_metrics(self):
+        """request metrics endpoint"""
+        return request_metrics.snapshot()
+
     def remove_item(self, item):
         """Remove item from program"""
         self.program.media_items.remove(item)
@@ -29,3 +29,4 @@ if __name__ == "__main__":
             time.sleep(1)
     except KeyboardInterrupt:
         runner.stop()
+        program.media_store.close()
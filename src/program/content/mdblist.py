@@ -1,7 +1,7 @@
 """Mdblist content module"""
 from utils.settings import settings_manager
 from utils.logger import logger
-from utils.request import RateLimitExceeded, RateLimiter, get
+from utils.request import RateLimitExceeded, get, get_rate_limiter
 from program.media import MediaItemContainer
 from program.updaters.trakt import Updater as Trakt
 
@@ -15,29 +15,31 @@ class Content:
         self.settings = settings_manager.get("mdblist")
         self.updater = Trakt()
         self.requests_per_2_minutes = self._calculate_request_time()
-        self.rate_limiter = RateLimiter(self.requests_per_2_minutes, 120, True)
+        # Shared with every request to mdblist, list requests take the tokens
+        self.rate_limiter = get_rate_limiter(
+            "www.mdblist.com", self.requests_per_2_minutes, 120, raise_on_limit=True
+        )
 
     def update_items(self, media_items: MediaItemContainer):
         """Fetch media from mdblist and add them to media_items attribute
         if they are not already there"""
         try:
-            with self.rate_limiter:
-                logger.info("Getting items...")
+            logger.info("Getting items...")
 
-                items = []
-                for list_id in self.settings["lists"]:
-                    if list_id:
-                        items += self._get_items_from_list(
-                            list_id, self.settings["api_key"]
-                        )
+            items = []
+            for list_id in self.settings["lists"]:
+                if list_id:
+                    items += self._get_items_from_list(
+                        list_id, self.settings["api_key"]
+                    )
 
-                container = self.updater.create_items(items)
-                added_items = media_items.extend(container)
-                if len(added_items) > 0:
-                    logger.info("Added %s items", len(added_items))
-                logger.info("Done!")
-        except RateLimitExceeded:
-            pass
+            container = self.updater.create_items(items)
+            added_items = media_items.extend(container)
+            if len(added_items) > 0:
+                logger.info("Added %s items", len(added_items))
+            logger.info("Done!")
+        except RateLimitExceeded as exception:
+            logger.debug("%s, trying again next cycle", exception)
 
     def _get_items_from_list(self, list_id: str, api_key: str) -> MediaItemContainer:
         return [item.imdb_id for item in list_items(list_id, api_key)]
@@ -60,5 +62,8 @@ def my_limits(api_key: str):
 
 def list_items(list_id: str, api_key: str):
     """Wrapper for mdblist api method 'List items'"""
-    response = get(f"http://www.mdblist.com/api/lists/{list_id}/items?apikey={api_key}")
+    response = get(
+        f"http://www.mdblist.com/api/lists/{list_id}/items?apikey={api_key}",
+        cache_ttl=60 * 5,
+    )
     return response.data
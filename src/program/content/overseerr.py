@@ -62,6 +62,7 @@ class Content:
             self.settings.get("url")
             + f"/api/v1/{overseerr_item.mediaType}/{external_id}?language=en",
             additional_headers={"X-Api-Key": self.settings.get("api_key")},
+            cache_ttl=60 * 60 * 24 * 7,
         )
         if response.is_ok:
             imdb_id = response.data.externalIds.imdbId
@@ -1,14 +1,15 @@
 """Realdebrid module"""
 import os
-import re
 import time
 from utils.logger import logger
 from utils.request import get, post
 from utils.settings import settings_manager
-from program.media import MediaItem, MediaItemContainer, MediaItemState
+from program.media import MediaItem, MediaItemContainer, MediaItemState, StreamFile
+from program.parser import count_episodes
 
 
 WANTED_FORMATS = [".mkv", ".mp4", ".avi"]
+MAX_INTERNED_FILES = 10000
 
 
 class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT IN LIBRARY CHOOSE ANOTHER TORRENT
@@ -18,6 +19,7 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
         self.settings = settings_manager.get("realdebrid")
         self.auth_headers = {"Authorization": f'Bearer {self.settings["api_key"]}'}
         self._torrents = {}
+        self._stream_files = {}
 
     def download(self, media_items: MediaItemContainer):
         """Download given media items from real-debrid.com"""
@@ -56,21 +58,21 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
         time.sleep(0.3)
         self.select_files(request_id, item)
 
-        folder_name = item.active_stream.get("name", None).split("\n")[0]
+        folder_name = item.active_stream.folder
 
         if item.type == "movie":
-            item.set("file_name", item.active_stream.get("name"))
+            item.set("file_name", item.active_stream.name)
             log_string = item.title
         if item.type == "season":
             if folder_name:
-                item.parent.locations.append(folder_name)
+                item.parent.set("locations", [*item.parent.locations, folder_name])
             log_string = f"{item.parent.title} season {item.number}"
             # item.parent.change_state(MediaItemState.PARTIALLY_DOWNLOADING)
         if item.type == "episode":
             log_string = f"{item.parent.parent.title} season {item.parent.number} episode {item.number}"
             if folder_name:
-                item.parent.parent.locations.append(folder_name)
-            item.set("file_name", item.active_stream.get("file_name"))
+                show = item.parent.parent
+                show.set("locations", [*show.locations, folder_name])
             # item.parent.parent.change_state(MediaItemState.PARTIALLY_DOWNLOADING)
         logger.debug("Downloaded %s", log_string)
         # item.change_state(MediaItemState.DOWNLOADING)
@@ -100,17 +102,15 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
 
     def _determine_best_stream(self, item) -> bool:
         """Returns true if season stream found for episode"""
-        cached = [
-            stream_hash
-            for stream_hash, stream_value in item.streams.items()
-            if stream_value.get("cached")
-        ]
-        for stream_hash, stream in item.streams.items():
-            # folder_name = stream["name"].split("\n")[0]
+        # Highest resolution first, torrentio order within the same resolution
+        for stream in sorted(
+            item.streams.values(),
+            key=lambda stream: stream.metadata.resolution,
+            reverse=True,
+        ):
             if item.type == "episode":
-                if self._real_episode_count(stream["files"]) >= len(
-                    item.parent.episodes
-                ):
+                episode_count = self._real_episode_count(stream.files)
+                if episode_count >= len(item.parent.episodes):
                     # item.parent.change_state(MediaItemState.SCRAPED)
                     item.parent.set("active_stream", stream)
                     logger.debug(
@@ -119,10 +119,9 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
                         item.parent.number,
                     )
                     return True
-                if self._real_episode_count(stream["files"]) == 0:
+                if episode_count == 0:
                     continue
-            if stream_hash in cached:
-                stream["hash"] = stream_hash
+            if stream.cached:
                 item.set("active_stream", stream)
                 break
         match (item.type):
@@ -139,7 +138,7 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
             logger.debug("Found cached release for %s", log_string)
         else:
             logger.debug("No cached release found for %s", log_string)
-            item.streams = {}
+            item.set("streams", {})
         return False
 
     def check_stream_availability(self, item: MediaItem):
@@ -159,12 +158,14 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
                 continue
             for containers in provider_list.values():
                 for container in containers:
-                    wanted_files = {
-                        file_id: file
-                        for file_id, file in container.items()
-                        if os.path.splitext(file["filename"])[1] in WANTED_FORMATS
-                        and file["filesize"] > 50000000
-                    }
+                    wanted_files = self._intern_files(
+                        tuple(
+                            StreamFile(file_id, file["filename"], file["filesize"])
+                            for file_id, file in container.items()
+                            if os.path.splitext(file["filename"])[1] in WANTED_FORMATS
+                            and file["filesize"] > 50000000
+                        )
+                    )
                     if wanted_files:
                         cached = False
                         if item.type == "season":
@@ -178,31 +179,23 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
                         if item.type == "episode":
                             if len(wanted_files) >= 1:
                                 cached = True
-                    item.streams[stream_hash]["files"] = wanted_files
-                    item.streams[stream_hash]["cached"] = cached
+                    item.set(
+                        f"streams.{stream_hash}",
+                        item.streams[stream_hash].with_availability(
+                            wanted_files, cached
+                        ),
+                    )
                     if cached:
                         return
 
     def _real_episode_count(self, files):
-        def count_episodes(episode_numbers):
-            count = 0
-            for episode in episode_numbers:
-                if "-" in episode:
-                    start, end = map(int, episode.split("-"))
-                    count += end - start + 1
-                else:
-                    count += 1
-            return count
-
-        total_count = 0
-        for file in files.values():
-            episode_numbers = re.findall(
-                r"E(\d{1,2}(?:-\d{1,2})?)",
-                file["filename"],
-                re.IGNORECASE,
-            )
-            total_count += count_episodes(episode_numbers)
-        return total_count
+        return count_episodes(file.filename for file in files)
+
+    def _intern_files(self, files: tuple) -> tuple:
+        """Share one tuple between streams with the same wanted files"""
+        if len(self._stream_files) > MAX_INTERNED_FILES:
+            self._stream_files.clear()
+        return self._stream_files.setdefault(files, files)
 
     def add_magnet(self, item: MediaItem) -> str:
         """Add magnet link to real-debrid.com"""
@@ -210,7 +203,7 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
             "https://api.real-debrid.com/rest/1.0/torrents/addMagnet",
             {
                 "magnet": "magnet:?xt=urn:btih:"
-                + item.active_stream["hash"]
+                + item.active_stream.hash
                 + "&dn=&tr="
             },
             additional_headers=self.auth_headers,
@@ -221,10 +214,10 @@ class Debrid:  # TODO CHECK TORRENTS LIST BEFORE DOWNLOAD, IF DOWNLOADED AND NOT
 
     def select_files(self, request_id, item) -> bool:
         """Select files from real-debrid.com"""
-        files = item.active_stream.get("files")
+        files = item.active_stream.files
         response = post(
             f"https://api.real-debrid.com/rest/1.0/torrents/selectFiles/{request_id}",
-            {"files": ",".join(files.keys())},
+            {"files": ",".join(file.id for file in files)},
             additional_headers=self.auth_headers,
         )
         return response.is_ok
@@ -1,9 +1,11 @@
 """Plex library module"""
 import os
 import copy
+from functools import partial
 from plexapi.server import PlexServer
 from requests.exceptions import ReadTimeout
 from utils.logger import logger
+from utils.request import metered_session
 from utils.settings import settings_manager as settings
 from program.media import (
     Episode,
@@ -21,7 +23,10 @@ class Library:
     def __init__(self):
         self.class_settings = settings.get("plex")
         self.plex = PlexServer(
-            self.class_settings["address"], self.class_settings["token"], timeout=5
+            self.class_settings["address"],
+            self.class_settings["token"],
+            session=metered_session(),
+            timeout=5,
         )
 
     def update_items(self, media_items: MediaItemContainer):
@@ -56,15 +61,11 @@ class Library:
     def _create_item(self, item):
         new_item = _map_item_from_data(item, item.type)
         if new_item and item.type == "show":
-            for season in item.seasons():
-                if season.seasonNumber != 0:
-                    new_season = _map_item_from_data(season, "season")
-                    if new_season:
-                        for episode in season.episodes():
-                            new_episode = _map_item_from_data(episode, "episode")
-                            if new_episode:
-                                new_season.add_episode(new_episode)
-                        new_item.add_season(new_season)
+            # Every episode found in plex is in the library, so the seasons
+            # are only fetched when something needs them
+            new_item.defer_seasons(
+                partial(_create_seasons, item), MediaItemState.LIBRARY
+            )
         return new_item
 
     def match_items(
@@ -77,28 +78,9 @@ class Library:
         items_to_be_removed = []
 
         for item in media_items:
-            if not item:
+            if not item or item.state == MediaItemState.LIBRARY:
                 continue
-            library_item = next(
-                (
-                    library_item
-                    for library_item in found_items
-                    if item.state != MediaItemState.LIBRARY
-                    and (
-                        item.type == "movie"
-                        and library_item.type == "movie"
-                        and item.file_name == library_item.file_name
-                        or item.type == "show"
-                        and library_item.type == "show"
-                        and any(
-                            location in item.locations
-                            for location in library_item.locations
-                        )
-                        or item.imdb_id == library_item.imdb_id
-                    )
-                ),
-                None,
-            )
+            library_item = found_items.get(item)
 
             if library_item:
                 if self._fix_match(library_item, item):
@@ -151,7 +133,7 @@ class Library:
                 # If the current item season has fewer or
                 # same episodes as the library item season, replace it
                 if len(season.episodes) <= len(matching_library_season.episodes):
-                    item.seasons[season_index] = matching_library_season
+                    item.replace_season(season_index, matching_library_season)
                 else:  # If not, we need to check each episode
                     for episode in season.episodes:
                         matching_library_episode = next(
@@ -169,10 +151,9 @@ class Library:
                             true_episode_number = episode.number
                             # matching_library_episode.number = episode.number
                             episode_index = season.episodes.index(episode)
-                            season.episodes[episode_index] = copy.copy(
-                                matching_library_episode
-                            )
-                            season.episodes[episode_index].number = true_episode_number
+                            new_episode = copy.copy(matching_library_episode)
+                            new_episode.number = true_episode_number
+                            season.replace_episode(episode_index, new_episode)
                             continue
                         # if the episode is not in library item season, change its state
                         else:
@@ -214,6 +195,21 @@ class Library:
         return False
 
 
+def _create_seasons(item) -> list[Season]:
+    """Create seasons with episodes of plex show item"""
+    seasons = []
+    for season in item.seasons():
+        if season.seasonNumber != 0:
+            new_season = _map_item_from_data(season, "season")
+            if new_season:
+                for episode in season.episodes():
+                    new_episode = _map_item_from_data(episode, "episode")
+                    if new_episode:
+                        new_season.add_episode(new_episode)
+                seasons.append(new_season)
+    return seasons
+
+
 def _map_item_from_data(item, item_type):
     """Map plex API data to MediaItemContainer"""
     # Fetch all data from plex API and catch ReadTimeout
@@ -2,9 +2,13 @@
 
 import datetime
 from enum import Enum
-import re
+import os
 import threading
+from types import MappingProxyType
+from typing import NamedTuple
+import weakref
 import dill
+from program.parser import count_episodes, parse_episodes, title_index
 
 
 class MediaItemState(Enum):
@@ -23,38 +27,202 @@ class MediaItemState(Enum):
     PARTIALLY_DOWNLOADING = 10
 
 
+INDEXED_ATTRIBUTES = ("imdb_id", "file_name", "locations", "key")
+STATE_ATTRIBUTES = ("key", "streams", "active_stream", "seasons", "episodes")
+
+
+NO_STREAMS = MappingProxyType({})
+_lock_allocation_lock = threading.Lock()
+
+
+class StreamFile(NamedTuple):
+    """Wanted file of a cached release"""
+
+    id: str
+    filename: str
+    filesize: int
+
+
+class Stream:
+    """Release scraped for a media item"""
+
+    __slots__ = ("hash", "name", "folder", "seeds", "files", "cached")
+
+    def __init__(self, stream_hash, name, seeds=0, files=(), cached=None):
+        self.hash = stream_hash
+        self.name = name
+        self.folder = name.split("\n")[0]
+        self.seeds = seeds
+        self.files = files
+        self.cached = cached
+
+    @property
+    def metadata(self):
+        """Metadata parsed from the release title, shared by info hash"""
+        return title_index.get(self.hash, self.name, self.seeds)
+
+    def with_availability(self, files, cached) -> "Stream":
+        """Copy of stream with given availability"""
+        return Stream(self.hash, self.name, self.seeds, files, cached)
+
+    @classmethod
+    def from_dict(cls, stream_hash, data: dict) -> "Stream":
+        """Create stream from the dict used before streams had their own type"""
+        files = tuple(
+            StreamFile(file_id, file["filename"], file["filesize"])
+            for file_id, file in data.get("files", {}).items()
+        )
+        return cls(
+            stream_hash,
+            data["name"],
+            int(data.get("seeds") or 0),
+            files,
+            data.get("cached", None),
+        )
+
+    def __repr__(self):
+        return f"Stream:{self.hash}:{self.cached}"
+
+
 class MediaItem:
-    """MediaItem class"""
+    """MediaItem class
+
+    Fields are slotted and rarely used containers (lock, streams, genres,
+    container references) start out as shared empty values, so the large
+    number of seasons and episodes in a library stay small."""
+
+    __slots__ = (
+        "_item_lock",
+        "_containers",
+        "_state",
+        "_state_generation",
+        "_store_id",
+        "_dirty",
+        "_dirty_children",
+        "parent",
+        "type",
+        "scraped_at",
+        "scrape_attempts",
+        "active_stream",
+        "streams",
+        "title",
+        "imdb_id",
+        "aired_at",
+        "genres",
+        "key",
+        "guid",
+        "art_url",
+    )
 
     def __init__(self, item):
-        self._lock = threading.Lock()
-        # self._state = item.get("state", MediaItemState.UNKNOWN)
-        self.scraped_at = 0
+        self._init_defaults()
         self.active_stream = item.get("active_stream", None)
-        self.streams = {}
 
         # Media related
         self.title = item.get("title", None)
         self.imdb_id = item.get("imdb_id", None)
-        if self.imdb_id:
-            self.imdb_link = f"https://www.imdb.com/title/{self.imdb_id}/"
         self.aired_at = item.get("aired_at", None)
-        self.genres = item.get("genres", [])
+        self.genres = item.get("genres") or ()
 
         # Plex related
         self.key = item.get("key", None)
         self.guid = item.get("guid", None)
         self.art_url = item.get("art_url", None)
 
+    def _init_defaults(self):
+        self._item_lock = None
+        self._containers = ()
+        self._state = None
+        self._state_generation = 0
+        self._store_id = None
+        self._dirty = True
+        self._dirty_children = False
+        self.parent = None
+        self.type = None
+        self.scraped_at = 0
+        self.scrape_attempts = 0
+        self.active_stream = None
+        self.streams = NO_STREAMS
+        self.title = None
+        self.imdb_id = None
+        self.aired_at = None
+        self.genres = ()
+        self.key = None
+        self.guid = None
+        self.art_url = None
+
+    @property
+    def _lock(self):
+        lock = self._item_lock
+        if lock is None:
+            with _lock_allocation_lock:
+                if self._item_lock is None:
+                    self._item_lock = threading.Lock()
+                lock = self._item_lock
+        return lock
+
+    @property
+    def imdb_link(self):
+        """Link to imdb page of item"""
+        if self.imdb_id:
+            return f"https://www.imdb.com/title/{self.imdb_id}/"
+        return None
+
+    @property
+    def state(self):
+        """Item state, computed once and cached until invalidated
+
+        A state computed while the item is invalidated by another thread is
+        returned but not kept."""
+        state = self._state
+        if state is None:
+            generation = self._state_generation
+            state = self._state = self._determine_state()
+            if self._state_generation != generation:
+                self._state = None
+        return state
+
+    def _determine_state(self):
+        raise NotImplementedError
+
+    def invalidate_state(self):
+        """Drop cached state of item and the items it belongs to"""
+        item = self
+        while item is not None:
+            item._state_generation += 1
+            item._state = None
+            for container in item._containers:
+                container.restate(item)
+            item = item.parent
+
+    def mark_dirty(self):
+        """Mark item to be written on the next save of the media store"""
+        self._dirty = True
+        item = self.parent
+        while item is not None and not item._dirty_children:
+            item._dirty_children = True
+            item = item.parent
+
+    def attach(self, container):
+        """Register container holding this item"""
+        if not self._containers:
+            self._containers = weakref.WeakSet()
+        self._containers.add(container)
+
+    def detach(self, container):
+        """Unregister container holding this item"""
+        if self._containers:
+            self._containers.discard(container)
+
     def is_cached(self):
         if self.streams:
-            return any(stream.get("cached", None) for stream in self.streams.values())
+            return any(stream.cached for stream in self.streams.values())
         return False
 
     def is_checked_for_availability(self):
         if self.streams:
             return all(
-                stream.get("cached", None) is not None
+                stream.cached is not None
                 for stream in self.streams.values()
             )
         return False
@@ -63,16 +231,20 @@ class MediaItem:
         return not self.is_cached()
 
     def __iter__(self):
-        with self._lock:
-            for attr, _ in vars(self).items():
-                yield attr
+        attrs = [
+            attr
+            for cls in type(self).__mro__
+            for attr in getattr(cls, "__slots__", ())
+            if attr != "_item_lock"
+        ]
+        attrs += list(getattr(self, "__dict__", {}))
+        yield from attrs
 
     def __eq__(self, other):
-        with self._lock:
-            value = False
-            if self.imdb_id and other.imdb_id:
-                value = self.imdb_id == other.imdb_id
-            return value
+        value = False
+        if self.imdb_id and other.imdb_id:
+            value = self.imdb_id == other.imdb_id
+        return value
 
     def get(self, key, default=None):
         """Get item attribute"""
@@ -83,6 +255,46 @@ class MediaItem:
         """Set item attribute"""
         with self._lock:
             _set_nested_attr(self, key, value)
+        self.mark_dirty()
+        attr = key.split(".", 1)[0]
+        if attr in STATE_ATTRIBUTES:
+            self.invalidate_state()
+        if attr in INDEXED_ATTRIBUTES:
+            for container in self._containers:
+                container.reindex(self)
+
+    def __getstate__(self):
+        state = {
+            attr: getattr(self, attr)
+            for attr in self
+            if attr not in ("_containers", "_state", "_state_generation")
+        }
+        if not state["streams"]:
+            del state["streams"]
+        if not state["genres"]:
+            del state["genres"]
+        state["_store_id"] = None
+        state["_dirty"] = True
+        state["_dirty_children"] = False
+        return state
+
+    def __setstate__(self, state):
+        self._init_defaults()
+        for attr, value in state.items():
+            try:
+                setattr(self, attr, value)
+            except AttributeError:
+                # Attribute is no longer part of the class
+                pass
+        if isinstance(self.active_stream, dict):
+            self.active_stream = Stream.from_dict(
+                self.active_stream.get("hash"), self.active_stream
+            )
+        if any(isinstance(stream, dict) for stream in self.streams.values()):
+            self.streams = {
+                stream_hash: Stream.from_dict(stream_hash, stream)
+                for stream_hash, stream in self.streams.items()
+            }
 
 
 class Movie(MediaItem):
@@ -94,11 +306,16 @@ class Movie(MediaItem):
         self.file_name = item.get("file_name", None)
         self.scrape_pattern = None
 
-    @property
-    def state(self):
+    def _init_defaults(self):
+        super()._init_defaults()
+        self.type = "movie"
+        self.file_name = None
+        self.scrape_pattern = None
+
+    def _determine_state(self):
         if self.key:
             return MediaItemState.LIBRARY
-        if any(stream.get("cached", None) for stream in self.streams.values()):
+        if any(stream.cached for stream in self.streams.values()):
             return MediaItemState.DOWNLOADING
         if len(self.streams) > 0:
             return MediaItemState.SCRAPED
@@ -116,14 +333,68 @@ class Movie(MediaItem):
 
 
 class Show(MediaItem):
-    """Show class"""
+    """Show class
+
+    Seasons can be deferred to a loader, the show then reports the summary
+    state given with the loader until something accesses its seasons."""
 
     def __init__(self, item):
         super().__init__(item)
         self.locations = item.get("locations", [])
-        self.seasons = item.get("seasons", [])
+        self._seasons = item.get("seasons", [])
+        self._seasons_loader = None
+        self._summary_state = None
         self.type = "show"
 
+    def _init_defaults(self):
+        super()._init_defaults()
+        self.type = "show"
+        self.locations = []
+        self._seasons = []
+        self._seasons_loader = None
+        self._summary_state = None
+
+    @property
+    def seasons(self) -> list:
+        """Seasons of show, loaded on first access if deferred"""
+        if self._seasons is None:
+            self._load_seasons()
+        return self._seasons
+
+    @seasons.setter
+    def seasons(self, seasons):
+        self._seasons = seasons
+        self._seasons_loader = None
+
+    @property
+    def loaded_seasons(self) -> list:
+        """Seasons of show without loading deferred seasons"""
+        return self._seasons or []
+
+    @property
+    def seasons_loaded(self) -> bool:
+        return self._seasons is not None
+
+    def defer_seasons(self, loader, summary_state=None):
+        """Load seasons with loader only when they are needed"""
+        self._seasons = None
+        self._seasons_loader = loader
+        self._summary_state = summary_state
+        self.invalidate_state()
+
+    def _load_seasons(self):
+        with self._lock:
+            if self._seasons is not None:
+                return
+            seasons = self._seasons_loader()
+            for season in seasons:
+                season.parent = self
+            self._seasons = seasons
+            self._seasons_loader = None
+        if any(season._store_id is None for season in seasons):
+            self.mark_dirty()
+        self.invalidate_state()
+
     def __eq__(self, other):
         return isinstance(self, type(other)) and (
             any(location in other.locations for location in self.locations)
@@ -140,20 +411,20 @@ class Show(MediaItem):
             ]
         )
 
-    @property
-    def state(self):
-        if any(
-            season.state == MediaItemState.LIBRARY_ONGOING for season in self.seasons
-        ):
+    def _determine_state(self):
+        if self._seasons is None and self._summary_state is not None:
+            return self._summary_state
+        seasons = self.seasons
+        if any(season.state == MediaItemState.LIBRARY_ONGOING for season in seasons):
             return MediaItemState.LIBRARY_ONGOING
-        if all(season.state == MediaItemState.LIBRARY for season in self.seasons):
+        if all(season.state == MediaItemState.LIBRARY for season in seasons):
             return MediaItemState.LIBRARY
-        if all(season.state == MediaItemState.DOWNLOADING for season in self.seasons):
+        if all(season.state == MediaItemState.DOWNLOADING for season in seasons):
             return MediaItemState.DOWNLOADING
         if any(
             season.state
             in [MediaItemState.DOWNLOADING, MediaItemState.PARTIALLY_DOWNLOADING]
-            for season in self.seasons
+            for season in seasons
         ):
             return MediaItemState.PARTIALLY_DOWNLOADING
         return MediaItemState.CONTENT
@@ -163,23 +434,41 @@ class Show(MediaItem):
 
     def add_season(self, season):
         """Add season to show"""
+        seasons = self.seasons
         with self._lock:
-            self.seasons.append(season)
+            seasons.append(season)
             season.parent = self
+        self.mark_dirty()
+        self.invalidate_state()
+
+    def replace_season(self, index, season):
+        """Replace season at index with given season"""
+        seasons = self.seasons
+        with self._lock:
+            seasons[index] = season
+            season.parent = self
+        self.mark_dirty()
+        self.invalidate_state()
 
 
 class Season(MediaItem):
     """Season class"""
 
+    __slots__ = ("number", "episodes")
+
     def __init__(self, item):
         super().__init__(item)
         self.type = "season"
-        self.parent = None
         self.number = item.get("number", None)
         self.episodes = item.get("episodes", [])
 
-    @property
-    def state(self):
+    def _init_defaults(self):
+        super()._init_defaults()
+        self.type = "season"
+        self.number = None
+        self.episodes = []
+
+    def _determine_state(self):
         if len(self.episodes) == len(
             [
                 episode
@@ -213,30 +502,39 @@ class Season(MediaItem):
         with self._lock:
             self.episodes.append(episode)
             episode.parent = self
+        self.mark_dirty()
+        self.invalidate_state()
 
-    def get_real_episode_count(self):
-        file_names = [episode.file_name for episode in self.episodes]
+    def replace_episode(self, index, episode):
+        """Replace episode at index with given episode"""
+        with self._lock:
+            self.episodes[index] = episode
+            episode.parent = self
+        self.mark_dirty()
+        self.invalidate_state()
 
-        episode_numbers = []
-        for file_name in file_names:
-            episode_numbers.extend(
-                re.findall(r"E(\d{1,2}(?:-\d{1,2})?)", file_name, re.IGNORECASE)
-            )
-        return count_episodes(episode_numbers)
+    def get_real_episode_count(self):
+        return count_episodes(episode.file_name for episode in self.episodes)
 
 
 class Episode(MediaItem):
     """Episode class"""
 
+    __slots__ = ("number", "file_name")
+
     def __init__(self, item):
         super().__init__(item)
         self.type = "episode"
-        self.parent = None
         self.number = item.get("number", None)
         self.file_name = item.get("file_name", None)
 
-    @property
-    def state(self):
+    def _init_defaults(self):
+        super()._init_defaults()
+        self.type = "episode"
+        self.number = None
+        self.file_name = None
+
+    def _determine_state(self):
         if self.key:
             return MediaItemState.LIBRARY
         if self.is_cached():
@@ -252,116 +550,228 @@ class Episode(MediaItem):
         return f"Episode:{self.number}:{self.state}"
 
     def get_multi_episode_numbers(self):
-        file_episodes = []
-        if self.file_name:
-
-            def is_episode_segment(segment):
-                # Remove season prefix
-                no_season_segment = re.sub(r"S\d{1,2}", "", segment, flags=re.I)
-
-                # Extract potential episode patterns without the season prefix
-                extracted_episodes = re.findall(
-                    r"E\d{1,2}", no_season_segment, flags=re.I
-                )
-                if extracted_episodes:
-                    # Check validity of segment
-                    constructed_string = "".join(extracted_episodes)
-                    return (
-                        no_season_segment.lower() == constructed_string.lower()
-                        or no_season_segment.lower()
-                        == f"{extracted_episodes[0]}-{extracted_episodes[-1]}".lower()
-                    )
-
-            def extract_numeric_episodes(segment):
-                if is_episode_segment(segment):
-                    # Extract numeric part of episode patterns
-                    return re.findall(r"E(\d{1,2})", segment, flags=re.I)
-                return []
-
-            segments = re.split(r"[ .-]", self.file_name)
-            file_episodes = [
-                str(int(episode))
-                for segment in segments
-                for episode in extract_numeric_episodes(segment)
-            ]
-
-        return file_episodes
+        return [str(episode) for episode in parse_episodes(self.file_name).episodes]
 
 
 class MediaItemContainer:
-    """MediaItemContainer class"""
+    """MediaItemContainer class
+
+    Items are kept in insertion order and indexed by imdb_id, movie file_name,
+    show location and plex key, so membership checks and lookups don't need
+    to compare against every item in the container. Items are also bucketed
+    by state, buckets are updated lazily when items report a state change."""
 
     def __init__(self, items: list[MediaItem] = None):
-        self.items = []
+        self._bucket_lock = threading.Lock()
+        self._watchers = []
+        self._clear()
+        self.updated_at = None
         if items:
             self.items = items
-        self.updated_at = None
+
+    @property
+    def items(self) -> list[MediaItem]:
+        """Items in container"""
+        return list(self._items.values())
+
+    @items.setter
+    def items(self, items: list[MediaItem]):
+        for item in self._items.values():
+            if item is not None:
+                item.detach(self)
+        self._clear()
+        for item in items:
+            self._add(item)
+
+    def _clear(self):
+        self._items = {}
+        self._index = {attr: {} for attr in INDEXED_ATTRIBUTES}
+        self._index_entries = {}
+        self._stale = {}
+        self._buckets = {state: {} for state in MediaItemState}
+        self._item_states = {}
+        self._unsorted = {}
 
     def __iter__(self):
-        for item in self.items:
-            yield item
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return self._find(item) is not None or item is None and id(None) in self._items
 
     def __iadd__(self, other):
         if not isinstance(other, MediaItem) and other is not None:
             raise TypeError("Cannot append non-MediaItem to MediaItemContainer")
-        if other not in self.items:
-            self.items.append(other)
+        if other not in self:
+            self._add(other)
             self._set_updated_at()
         return self
 
     def __len__(self):
         """Get length of container"""
-        return len(self.items)
+        return len(self._items)
 
     def append(self, item) -> bool:
         """Append item to container"""
-        self.items.append(item)
+        self._add(item)
         self._set_updated_at()
 
     def get(self, item) -> MediaItem:
         """Get item matching given item from container"""
-        for my_item in self.items:
-            if my_item == item:
-                return my_item
-        return None
+        return self._find(item)
 
     def get_item(self, attr, value) -> "MediaItemContainer":
         """Get items that match given items"""
-        return next((item for item in self.items if getattr(item, attr) == value), None)
+        if attr in ("imdb_id", "file_name", "key") and value is not None:
+            self._refresh_index()
+            matches = self._index[attr].get(value)
+            return matches[0] if matches else None
+        return next(
+            (item for item in self._items.values() if getattr(item, attr) == value),
+            None,
+        )
 
     def extend(self, items) -> "MediaItemContainer":
         """Extend container with items"""
         added_items = MediaItemContainer()
         for media_item in items:
-            if media_item not in self.items:
-                self.items.append(media_item)
+            if media_item not in self:
+                self._add(media_item)
                 added_items.append(media_item)
         return added_items
 
     def _set_updated_at(self):
         self.updated_at = {
-            "length": len(self.items),
+            "length": len(self._items),
             "time": datetime.datetime.now().timestamp(),
         }
 
     def remove(self, item):
         """Remove item from container"""
-        if item in self.items:
-            self.items.remove(item)
+        my_item = self._find(item)
+        if my_item is not None:
+            self._unindex(my_item)
+            self._stale.pop(id(my_item), None)
+            with self._bucket_lock:
+                self._unsorted.pop(id(my_item), None)
+                state = self._item_states.pop(id(my_item), None)
+                if state is not None:
+                    del self._buckets[state][id(my_item)]
+            my_item.detach(self)
+            del self._items[id(my_item)]
             self._set_updated_at()
 
+    def reindex(self, item):
+        """Mark item to be reindexed after one of its indexed attributes changed"""
+        self._stale[id(item)] = item
+
+    def restate(self, item):
+        """Mark item to be moved to another state bucket after its state changed"""
+        self._unsorted[id(item)] = item
+        for watcher in self._watchers:
+            watcher(item)
+
+    def watch(self, callback):
+        """Call callback with every item added to the container or changing state
+
+        Changes of seasons and episodes are reported as their show changing."""
+        self._watchers.append(callback)
+
+    def _add(self, item):
+        self._items[id(item)] = item
+        if item is not None:
+            item.attach(self)
+            self._index_item(item)
+            self._unsorted[id(item)] = item
+            for watcher in self._watchers:
+                watcher(item)
+
+    def _find(self, item) -> MediaItem:
+        if item is None:
+            return None
+        self._refresh_index()
+        candidates = []
+        if item.imdb_id:
+            candidates += self._index["imdb_id"].get(item.imdb_id, [])
+        if isinstance(item, Movie) and item.file_name is not None:
+            candidates += self._index["file_name"].get(item.file_name, [])
+        elif isinstance(item, Show):
+            for location in item.locations:
+                candidates += self._index["locations"].get(location, [])
+        elif not isinstance(item, Movie):
+            # Seasons and episodes compare by number, there is nothing to index
+            candidates = self._items.values()
+        return next((my_item for my_item in candidates if my_item == item), None)
+
+    def _index_item(self, item):
+        entries = []
+        for attr in INDEXED_ATTRIBUTES:
+            value = getattr(item, attr, None)
+            if attr == "file_name" and not isinstance(item, Movie):
+                continue
+            values = value if attr == "locations" else [value]
+            for value in values or []:
+                if value is not None:
+                    self._index[attr].setdefault(value, []).append(item)
+                    entries.append((attr, value))
+        self._index_entries[id(item)] = entries
+
+    def _unindex(self, item):
+        for attr, value in self._index_entries.pop(id(item), []):
+            matches = [match for match in self._index[attr][value] if match is not item]
+            if matches:
+                self._index[attr][value] = matches
+            else:
+                del self._index[attr][value]
+
+    def _refresh_index(self):
+        while self._stale:
+            _, item = self._stale.popitem()
+            if id(item) in self._items:
+                self._unindex(item)
+                self._index_item(item)
+
+    def _refresh_buckets(self):
+        # Buckets are also refreshed from the api threads
+        with self._bucket_lock:
+            while self._unsorted:
+                item_id, item = self._unsorted.popitem()
+                if item_id not in self._items:
+                    continue
+                old_state = self._item_states.get(item_id)
+                new_state = item.state
+                if old_state != new_state:
+                    if old_state is not None:
+                        del self._buckets[old_state][item_id]
+                    self._buckets[new_state][item_id] = item
+                    self._item_states[item_id] = new_state
+
     def count(self, state) -> int:
         """Count items with given state in container"""
-        return len(self.get_items_with_state(state))
+        self._refresh_buckets()
+        return len(self._buckets[state])
+
+    def count_by_state(self) -> dict:
+        """Count items in container for every state"""
+        self._refresh_buckets()
+        return {state: len(items) for state, items in self._buckets.items()}
+
+    def get_items_with_state(self, state) -> list[MediaItem]:
+        """Get items with given state
 
-    def get_items_with_state(self, state):
-        """Get items that need to be updated"""
-        return MediaItemContainer([item for item in self.items if item.state == state])
+        Returns a plain list, a container would attach itself to the items
+        while other threads iterate their containers."""
+        self._refresh_buckets()
+        with self._bucket_lock:
+            return list(self._buckets[state].values())
 
     def save(self, filename):
-        """Save container to file"""
-        with open(filename, "wb") as file:
+        """Save container to file, replacing it only after the write succeeded"""
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, "wb") as file:
             dill.dump(self.items, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
 
     def load(self, filename):
         """Load container from file"""
@@ -388,14 +798,3 @@ def _set_nested_attr(obj, key, value):
                 obj[key] = value
         else:
             setattr(obj, key, value)
-
-
-def count_episodes(episode_nums):
-    count = 0
-    for ep in episode_nums:
-        if "-" in ep:  # Range of episodes
-            start, end = map(int, ep.split("-"))
-            count += end - start + 1
-        else:  # Individual episodes
-            count += 1
-    return count
@@ -0,0 +1,262 @@
+"""Release name parser module"""
+from collections import OrderedDict
+from functools import lru_cache
+import re
+import threading
+from typing import NamedTuple
+
+
+SEASON_PATTERN = re.compile(r"S(\d{1,2})", re.IGNORECASE)
+EPISODE_RANGE_PATTERN = re.compile(r"E(\d{1,2})(?:-(\d{1,2}))?", re.IGNORECASE)
+SEGMENT_SEPARATOR_PATTERN = re.compile(r"[ .-]")
+SEGMENT_SEASON_PATTERN = re.compile(r"S\d{1,2}", re.IGNORECASE)
+SEGMENT_EPISODE_PATTERN = re.compile(r"E(\d{1,2})", re.IGNORECASE)
+SEEDS_PATTERN = re.compile(r"👤\s*(\d*)\s*💾")
+MOVIE_YEAR_PATTERN = re.compile(r"(19|20)([0-9]{2} ?\.?)", re.IGNORECASE)
+SHOW_FOLDER_PATTERN = re.compile(
+    r"(S[0-9]{2}|SEASON|COMPLETE|[^457a-z\W\s]-[0-9]+)", re.IGNORECASE
+)
+NOT_MOVIE_PATTERN = re.compile(
+    r"Season|Episode|Collection|S\d{1,2}|E\d{1,2}", re.IGNORECASE
+)
+FOLDER_SEASON_PATTERN = re.compile(r"S\d{2}|Season \d{1,2}", re.IGNORECASE)
+FOLDER_EPISODE_PATTERN = re.compile(r"E\d{1,2}|Episode \d{1,2}")
+FILE_EPISODE_PATTERN = re.compile(
+    r"(S\d{1,2}|Season \d{1,2}).*(E\d{1,2}|Episode \d{1,2})", re.IGNORECASE
+)
+RESOLUTION_PATTERN = re.compile(
+    r"(?<![a-z0-9])(?:(2160|1440|1080|720|576|480|360)[pi]|(4k|uhd))(?![a-z0-9])",
+    re.IGNORECASE,
+)
+CODEC_PATTERN = re.compile(
+    r"(?<![a-z0-9])(x\.?26[45]|h\.?26[45]|hevc|avc|av1|xvid|divx|vp9)(?![a-z0-9])",
+    re.IGNORECASE,
+)
+SIZE_PATTERN = re.compile(r"💾\s*(\d+(?:[.,]\d+)?)\s*([KMGT])i?B", re.IGNORECASE)
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+CODECS = {"x264": "avc", "h264": "avc", "x265": "hevc", "h265": "hevc"}
+MAX_INDEXED_TITLES = 65536
+
+
+class ParsedEpisodes(NamedTuple):
+    """Season and episodes found in a release or file name
+
+    `episodes` holds the numbers of segments that consist only of season and
+    episode markers, like S01E02E03. `ranges` holds every E01 or E01-03
+    marker found anywhere in the name as (first, last) pairs."""
+
+    season: int
+    episodes: tuple
+    ranges: tuple
+
+    @property
+    def episode_count(self) -> int:
+        """Amount of episodes covered by the ranges"""
+        return sum(last - first + 1 for first, last in self.ranges)
+
+
+@lru_cache(maxsize=65536)
+def parse_episodes(name: str) -> ParsedEpisodes:
+    """Parse season and episode numbers from release or file name"""
+    if not name:
+        return ParsedEpisodes(None, (), ())
+
+    season = SEASON_PATTERN.search(name)
+    ranges = tuple(
+        (int(first), int(last or first))
+        for first, last in EPISODE_RANGE_PATTERN.findall(name)
+    )
+    episodes = tuple(
+        int(episode)
+        for segment in SEGMENT_SEPARATOR_PATTERN.split(name)
+        if _is_episode_segment(segment)
+        for episode in SEGMENT_EPISODE_PATTERN.findall(segment)
+    )
+    return ParsedEpisodes(int(season.group(1)) if season else None, episodes, ranges)
+
+
+def _is_episode_segment(segment: str) -> bool:
+    # Remove season prefix and check that only episode markers are left
+    no_season_segment = SEGMENT_SEASON_PATTERN.sub("", segment).lower()
+    extracted_episodes = [
+        f"e{episode}" for episode in SEGMENT_EPISODE_PATTERN.findall(no_season_segment)
+    ]
+    if not extracted_episodes:
+        return False
+    return (
+        no_season_segment == "".join(extracted_episodes)
+        or no_season_segment == f"{extracted_episodes[0]}-{extracted_episodes[-1]}"
+    )
+
+
+def count_episodes(names) -> int:
+    """Count episodes covered by given file names"""
+    return sum(parse_episodes(name).episode_count for name in names)
+
+
+class ParsedTitle(NamedTuple):
+    """Torrentio stream title split into its parts and whether it fits the item
+
+    `title` is the release title without the seeders and size line, which is
+    parsed by the title index."""
+
+    title: str
+    folder: str
+    file: str
+    accepted: bool
+
+
+def match_titles(item_type: str, titles):
+    """Parse stream titles of one response and decide which fit item_type"""
+    return (match_title(item_type, title) for title in titles)
+
+
+@lru_cache(maxsize=65536)
+def match_title(item_type: str, title: str) -> ParsedTitle:
+    """Parse stream title and decide if it fits item_type"""
+    complete_title = title.partition("\n👤")[0]
+    folder = complete_title.partition("\n")[0]
+    file = complete_title.rpartition("\n")[2]
+    return ParsedTitle(
+        complete_title, folder, file, _matches_formatting(item_type, file, folder)
+    )
+
+
+def _matches_formatting(item_type: str, file: str, folder: str) -> bool:
+    match item_type:
+        case "movie":
+            return bool(MOVIE_YEAR_PATTERN.search(file)) and not (
+                NOT_MOVIE_PATTERN.search(file)
+            )
+        case "season":
+            return bool(SHOW_FOLDER_PATTERN.search(folder)) and _is_season_folder(
+                folder
+            )
+        case "episode":
+            return (
+                bool(SHOW_FOLDER_PATTERN.search(folder))
+                and _is_season_folder(folder)
+                and bool(FILE_EPISODE_PATTERN.search(file))
+            )
+        case _:
+            return False
+
+
+def _is_season_folder(folder: str) -> bool:
+    """True if a season marker in folder has no episode marker after it"""
+    last_season_start = -1
+    for match in FOLDER_SEASON_PATTERN.finditer(folder):
+        last_season_start = match.start()
+    return (
+        last_season_start >= 0
+        and FOLDER_EPISODE_PATTERN.search(folder, last_season_start) is None
+    )
+
+
+class TitleMetadata(NamedTuple):
+    """Typed metadata of a stream title
+
+    `resolution` is the vertical resolution and `size` the size in bytes, both
+    0 when the title does not tell. `episodes` holds the (first, last) episode
+    ranges of the release name, a season without episodes is a season pack."""
+
+    title: str
+    resolution: int
+    codec: str
+    size: int
+    seeds: int
+    season: int
+    episodes: tuple
+
+    @property
+    def is_season_pack(self) -> bool:
+        """True if the release holds a whole season"""
+        return self.season is not None and not self.episodes
+
+
+class TitleIndex:
+    """Metadata of stream titles keyed by info hash
+
+    A release shows up in the results of its season and of every episode in
+    it, the release name is parsed the first time only. Seeders and size are
+    taken from the latest title seen for the hash. The least recently used
+    entries are dropped once `maxsize` hashes are indexed."""
+
+    def __init__(self, maxsize=MAX_INDEXED_TITLES):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, info_hash: str, title: str, seeds=0) -> TitleMetadata:
+        """Metadata of the stream title, parsed once per info hash
+
+        Titles without the seeders and size line keep the values indexed
+        before, or `seeds` and an unknown size for new hashes."""
+        with self._lock:
+            indexed_title, metadata = self._entries.get(info_hash, (None, None))
+            if metadata is not None:
+                self._entries.move_to_end(info_hash)
+        if indexed_title == title:
+            return metadata
+        release, _, stats = title.partition("\n👤")
+        if metadata is None or metadata.title != release:
+            metadata = _parse_release(release, seeds)
+        elif not stats:
+            return metadata
+        if stats:
+            metadata = _with_stats(metadata, title)
+        with self._lock:
+            self._entries[info_hash] = (title, metadata)
+            self._entries.move_to_end(info_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def clear(self):
+        """Drop all indexed titles"""
+        with self._lock:
+            self._entries.clear()
+
+
+def _parse_release(release: str, seeds: int) -> TitleMetadata:
+    folder = release.partition("\n")[0]
+    resolution = RESOLUTION_PATTERN.search(release)
+    codec = CODEC_PATTERN.search(release)
+    episodes = parse_episodes(folder)
+    if resolution is None:
+        resolution_value = 0
+    else:
+        resolution_value = int(resolution.group(1)) if resolution.group(1) else 2160
+    if codec is None:
+        codec_value = None
+    else:
+        codec_value = codec.group(1).lower().replace(".", "")
+        codec_value = CODECS.get(codec_value, codec_value)
+    return TitleMetadata(
+        release,
+        resolution_value,
+        codec_value,
+        0,
+        seeds,
+        episodes.season,
+        episodes.ranges,
+    )
+
+
+def _with_stats(metadata: TitleMetadata, title: str) -> TitleMetadata:
+    seeds = SEEDS_PATTERN.search(title)
+    size = SIZE_PATTERN.search(title)
+    return metadata._replace(
+        seeds=int(seeds.group(1) or 0) if seeds else metadata.seeds,
+        size=(
+            int(float(size.group(1).replace(",", ".")) * SIZE_UNITS[size.group(2).upper()])
+            if size
+            else metadata.size
+        ),
+    )
+
+
+title_index = TitleIndex()
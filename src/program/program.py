@@ -4,7 +4,9 @@ import inspect
 import os
 import sys
 from utils.logger import logger
+from utils.request import enable_cache
 from program.media import MediaItemContainer
+from program.store import MediaStore
 from program.libraries.plex import Library as Plex
 from program.debrid.realdebrid import Debrid as RealDebrid
 from program.scrapers.torrentio import Scraper as Torrentio
@@ -14,23 +16,24 @@ class Program:
     """Program class"""
 
     def __init__(self):
+        if not os.path.exists("data"):
+            os.mkdir("data")
+        enable_cache("data/requests.db")
+
         self.plex = Plex()
         self.debrid = RealDebrid()
         self.torrentio = Torrentio()
 
         self.media_items = MediaItemContainer()
+        self.media_store = MediaStore("data/media.db")
+        self.media_store.load(self.media_items)
 
         self.content_services = self.__import_modules("src/program/content")
         self.scraping_services = self.__import_modules("src/program/scrapers")
         self.debrid_services = self.__import_modules("src/program/debrid")
 
-        if not os.path.exists("data"):
-            os.mkdir("data")
-
     def run(self):
         """Run the program"""
-        self.media_items.load("data/media.pkl")
-
         self.plex.update_sections(self.media_items)
 
         # Update content lists
@@ -42,7 +45,7 @@ class Program:
         self.torrentio.scrape(self.media_items)
         self.debrid.download(self.media_items)
 
-        self.media_items.save("data/media.pkl")
+        self.media_store.save(self.media_items)
 
     def __import_modules(self, folder_path: str) -> list[object]:
         file_list = [
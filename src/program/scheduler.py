@@ -0,0 +1,52 @@
+"""Scrape scheduler module"""
+import heapq
+import itertools
+
+
+class ScrapeScheduler:
+    """Min-heap of media items keyed by the time they are due and priority
+
+    Entries are (due, priority, sequence, item) lists. Removing an item only
+    clears the item from its entry, cleared entries are skipped when they reach
+    the top of the heap."""
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def __contains__(self, item) -> bool:
+        return id(item) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, item, due: float, priority=0):
+        """Schedule item at due timestamp, replacing its earlier entry"""
+        self.remove(item)
+        entry = [due, priority, next(self._counter), item]
+        self._entries[id(item)] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, item):
+        """Unschedule item"""
+        entry = self._entries.pop(id(item), None)
+        if entry is not None:
+            entry[-1] = None
+
+    def pop_due(self, now: float) -> list:
+        """Remove and return items due at now, lowest priority value first"""
+        entries = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if entry[-1] is not None:
+                del self._entries[id(entry[-1])]
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry[1])
+        return [entry[-1] for entry in entries]
+
+    def next_due(self) -> float:
+        """Timestamp of the earliest scheduled item, None if nothing is scheduled"""
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
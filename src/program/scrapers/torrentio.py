@@ -1,15 +1,30 @@
 """ Torrentio scraper module """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-import re
-from requests.exceptions import RequestException
+from functools import lru_cache
+from itertools import islice
+import random
+from utils.cache import DiskCache
 from utils.logger import logger
-from utils.request import RateLimitExceeded, get, RateLimiter
+from utils.request import RateLimitExceeded, get, get_rate_limiter
 from utils.settings import settings_manager
 from program.media import (
     MediaItem,
     MediaItemContainer,
     MediaItemState,
+    Stream,
 )
+from program.parser import match_titles, title_index
+from program.scheduler import ScrapeScheduler
+
+
+RESULT_TTL = 60 * 60 * 6
+RESCRAPE_INTERVAL = 60 * 30
+MAX_RESCRAPE_INTERVAL = 60 * 60 * 24 * 7
+RESCRAPE_JITTER = 0.1
+NEWLY_AIRED_PERIOD = 60 * 60 * 24 * 7
+# Expires by the next try, so every counted attempt asks torrentio again
+EMPTY_RESULT_TTL = RESCRAPE_INTERVAL
 
 
 class Scraper:
@@ -19,79 +34,173 @@ class Scraper:
         self.settings = "torrentio"
         self.class_settings = settings_manager.get(self.settings)
         self.last_scrape = 0
+        self.workers = self.class_settings.get("workers", 1)
+        self.cache = DiskCache("data/torrentio.db")
+        self.scheduler = ScrapeScheduler()
+        self.watched_items = None
+        self.changed_items = {}
         self.filters = (
             f'sort=qualitysize%7Cqualityfilter={self.class_settings["filter"]}'
         )
-        self.minute_limiter = RateLimiter(
-            max_calls=140, period=60 * 5, raise_on_limit=True
+        self.minute_limiter = get_rate_limiter(
+            "torrentio.strem.fun", max_calls=140, period=60 * 5, raise_on_limit=True
+        )
+        self.second_limiter = get_rate_limiter(
+            "torrentio.strem.fun", max_calls=1, period=1
         )
-        self.second_limiter = RateLimiter(max_calls=1, period=1)
 
     def scrape(self, media_items: MediaItemContainer):
-        """Scrape the torrentio site for the given media items
+        """Scrape the torrentio site for the given media items that are due
         and update the object with scraped streams"""
         logger.info("Scraping...")
         scraped_amount = 0
-        items = [item for item in media_items if self._can_we_scrape(item)]
-        for item in items:
-            try:
-                if item.type == "movie":
-                    scraped_amount += self._scrape_items([item])
+        self._schedule_items(media_items)
+        now = datetime.now().timestamp()
+        items = [
+            item
+            for item in self.scheduler.pop_due(now)
+            if _is_tracked(item, media_items)
+        ]
+        waiting_episodes = []
+        try:
+            # Episodes are only scraped for seasons without results,
+            # so every season has to be done before its episodes
+            scraped_amount += self._scrape_items(
+                [
+                    item
+                    for item in items
+                    if item.type != "episode" and self._can_we_scrape(item)
+                ]
+            )
+            episodes = []
+            for episode in (item for item in items if item.type == "episode"):
+                if episode.parent.state in [
+                    MediaItemState.SCRAPED_NOT_FOUND,
+                    MediaItemState.LIBRARY_ONGOING,
+                ]:
+                    if self._can_we_scrape(episode):
+                        episodes.append(episode)
                 else:
-                    scraped_amount += self._scrape_show(item)
-            except RequestException as exception:
-                logger.error("%s, trying again next cycle", exception)
-                break
-            except RateLimitExceeded as exception:
-                logger.error("%s, trying again next cycle", exception)
-                break
+                    waiting_episodes.append(episode)
+            scraped_amount += self._scrape_items(episodes)
+        except RateLimitExceeded as exception:
+            logger.error("%s, trying again next cycle", exception)
+        finally:
+            for episode in waiting_episodes:
+                self._schedule(episode, now + RESCRAPE_INTERVAL)
+            for item in items:
+                self._schedule(item)
         if scraped_amount > 0:
             logger.info("Scraped %s streams", scraped_amount)
         logger.info("Done!")
 
-    def _scrape_show(self, item: MediaItem):
-        scraped_amount = 0
-        seasons = [season for season in item.seasons if self._can_we_scrape(season)]
-        scraped_amount += self._scrape_items(seasons)
-        episodes = [
-            episode
-            for season in item.seasons
-            if season.state
-            in [MediaItemState.SCRAPED_NOT_FOUND, MediaItemState.LIBRARY_ONGOING]
-            for episode in season.episodes
-            if self._can_we_scrape(episode)
-        ]
-        scraped_amount += self._scrape_items(episodes)
-        return scraped_amount
+    def _schedule_items(self, media_items: MediaItemContainer):
+        """Schedule scrapable items of movies and shows added or changed
+        since the last cycle"""
+        if self.watched_items is not media_items:
+            self.watched_items = media_items
+            self.changed_items = {
+                id(item): item for item in media_items if item is not None
+            }
+            media_items.watch(self._item_changed)
+        while self.changed_items:
+            _, item = self.changed_items.popitem()
+            if item.type == "movie":
+                self._schedule(item)
+            elif item.state in [MediaItemState.CONTENT, MediaItemState.LIBRARY_ONGOING]:
+                for season in item.seasons:
+                    self._schedule(season)
+                    for episode in season.episodes:
+                        self._schedule(episode)
+
+    def _item_changed(self, item: MediaItem):
+        if item is not None:
+            self.changed_items[id(item)] = item
 
-    def _scrape_items(self, items: list):
+    def _schedule(self, item: MediaItem, not_before=0):
+        """Push item to the scheduler with the time it can be scraped next
+
+        Newly aired items come first, then items never scraped before."""
+        if item in self.scheduler or item.state != MediaItemState.CONTENT:
+            return
+        aired_at = _aired_at_timestamp(item.aired_at)
+        if aired_at is None:
+            return
+        now = datetime.now().timestamp()
+        if now - aired_at < NEWLY_AIRED_PERIOD:
+            priority = 0
+        elif item.scraped_at == 0:
+            priority = 1
+        else:
+            priority = 2
+        due = max(aired_at, item.scraped_at + _rescrape_interval(item), not_before)
+        self.scheduler.push(item, due, priority)
+
+    def _scrape_items(self, items: list) -> int:
+        """Scrape items on the worker pool, applying results as they arrive
+
+        Raises RateLimitExceeded once the running scrapes are done if any of
+        them hit the rate limit, no new scrapes are started after that."""
         amount_scraped = 0
-        for item in items:
-            data = self.api_scrape(item)
-            log_string = item.title
-            if item.type == "season":
-                log_string = f"{item.parent.title} season {item.number}"
-            if item.type == "episode":
-                log_string = f"{item.parent.parent.title} season {item.parent.number} episode {item.number}"
-            if len(data) > 0:
-                item.set("streams", data)
-                # item.change_state(MediaItemState.SCRAPED)
-                logger.debug("Found %s streams for %s", len(data), log_string)
-                amount_scraped += 1
-                continue
-            logger.debug("Could not find streams for %s", log_string)
+        rate_limit_error = None
+        items = iter(items)
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="torrentio") as executor:
+            running = {
+                executor.submit(self.api_scrape, item): item
+                for item in islice(items, self.workers)
+            }
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = running.pop(future)
+                    try:
+                        data = future.result()
+                    except RateLimitExceeded as exception:
+                        rate_limit_error = exception
+                        continue
+                    except Exception:
+                        logger.error("Failed to scrape %s", _log_string(item), exc_info=True)
+                        item.set("scraped_at", datetime.now().timestamp())
+                        continue
+                    amount_scraped += self._apply_streams(item, data)
+                if rate_limit_error is None:
+                    for item in islice(items, len(done)):
+                        running[executor.submit(self.api_scrape, item)] = item
+        if rate_limit_error is not None:
+            raise rate_limit_error
         return amount_scraped
 
+    def _apply_streams(self, item: MediaItem, data: dict) -> int:
+        if data is None:
+            # Failed request, not an empty result, so no further backing off
+            item.set("scraped_at", datetime.now().timestamp())
+            logger.debug("Failed to scrape %s", _log_string(item))
+            return 0
+        if len(data) > 0:
+            attempts = 0
+        elif _latest_aired_at(item) > item.scraped_at:
+            # Something aired since the last try, start backing off again
+            attempts = 1
+        else:
+            attempts = item.scrape_attempts + 1
+        item.set("scraped_at", datetime.now().timestamp())
+        item.set("scrape_attempts", attempts)
+        if len(data) > 0:
+            item.set("streams", data)
+            # item.change_state(MediaItemState.SCRAPED)
+            logger.debug("Found %s streams for %s", len(data), _log_string(item))
+            return 1
+        logger.debug("Could not find streams for %s", _log_string(item))
+        return 0
+
     def _can_we_scrape(self, item: MediaItem) -> bool:
         def is_released():
-            return (
-                item.aired_at is not None
-                and datetime.strptime(item.aired_at, "%Y-%m-%d:%H") < datetime.now()
-            )
+            aired_at = _aired_at_timestamp(item.aired_at)
+            return aired_at is not None and aired_at < datetime.now().timestamp()
 
         def needs_new_scrape():
             return (
-                datetime.now().timestamp() - item.scraped_at > 60 * 30
+                datetime.now().timestamp() - item.scraped_at > _rescrape_interval(item)
                 or item.scraped_at == 0
             )
 
@@ -121,90 +230,137 @@ class Scraper:
         return False
 
     def api_scrape(self, item):
-        """Wrapper for torrentio scrape method"""
-        with self.minute_limiter:
-            if item.type == "season":
-                identifier = f":{item.number}:1"
-                scrape_type = "show"
-                imdb_id = item.parent.imdb_id
-            elif item.type == "episode":
-                identifier = f":{item.parent.number}:{item.number}"
-                scrape_type = "show"
-                imdb_id = item.parent.parent.imdb_id
-            else:
-                identifier = None
-                scrape_type = "movie"
-                imdb_id = item.imdb_id
-
-            url = (
-                f"https://torrentio.strem.fun/{self.filters}"
-                + f"/stream/{scrape_type}/{imdb_id}"
-            )
-            if identifier:
-                url += f"{identifier}"
-            with self.second_limiter:
-                response = get(f"{url}.json", retry_if_failed=False)
-                item.set("scraped_at", datetime.now().timestamp())
-            if response.is_ok:
-                data = {}
-                for stream in response.data.streams:
-                    # lets get only 20 streams
-                    if len(data) >= 20:
-                        break
-                    complete_title = stream.title.split("\n👤")[0]
-                    folder = complete_title.split("\n")[0]
-                    file = complete_title.split("\n")[-1]
-                    if not _matches_formatting(item, file, folder):
-                        continue
-                    data[stream.infoHash] = {
-                        "name": stream.title.split("\n👤")[0],
-                        "seeds": re.search(r"👤\s*(\d*)\s*💾", stream.title).group(1),
-                    }
+        """Wrapper for torrentio scrape method
 
-                if len(data) > 0:
-                    return data
-            else:
-                # item.change_state(MediaItemState.ERROR)
-                pass
-            return {}
+        Returns None if torrentio could not be reached."""
+        if item.type == "season":
+            identifier = f":{item.number}:1"
+            scrape_type = "show"
+            imdb_id = item.parent.imdb_id
+        elif item.type == "episode":
+            identifier = f":{item.parent.number}:{item.number}"
+            scrape_type = "show"
+            imdb_id = item.parent.parent.imdb_id
+        else:
+            identifier = None
+            scrape_type = "movie"
+            imdb_id = item.imdb_id
 
+        streams = self._get_streams(scrape_type, imdb_id, identifier or "")
+        if streams is None:
+            return None
+        data = {}
+        for (info_hash, title), parsed in zip(
+            streams, match_titles(item.type, (title for _, title in streams))
+        ):
+            # lets get only 20 streams
+            if len(data) >= 20:
+                break
+            if parsed.accepted:
+                metadata = title_index.get(info_hash, title)
+                data[info_hash] = Stream(info_hash, parsed.title, metadata.seeds)
+        return data
 
-def _matches_formatting(item: MediaItem, file: str, folder: str) -> bool:
-    if not _matches_rclone_formatting(item, file, folder):
-        return False
+    def _get_streams(self, scrape_type, imdb_id, identifier) -> list:
+        """Get (info hash, title) pairs of torrentio streams, cached on disk
 
-    def match_folder(folder: str):
-        season_pattern = r"(S\d{2}|Season \d{1,2})"
-        episode_pattern = r"(E\d{1,2}|Episode \d{1,2})"
-        matches = re.finditer(season_pattern, folder, re.IGNORECASE)
-        return [
-            match.group()
-            for match in matches
-            if not re.search(episode_pattern, folder[match.start():])
+        A season is looked up as its first episode, so both share one entry.
+        Returns None if torrentio could not be reached."""
+        key = f"{imdb_id}{identifier} {self.filters}"
+        entry = self.cache.get(key)
+        if entry and not entry.is_expired:
+            return entry.value
+        url = (
+            f"https://torrentio.strem.fun/{self.filters}"
+            + f"/stream/{scrape_type}/{imdb_id}{identifier}.json"
+        )
+        response = get(url, retry_if_failed=False, response_type=dict)
+        if not response.is_ok:
+            # item.change_state(MediaItemState.ERROR)
+            return None
+        streams = [
+            (stream["infoHash"], stream["title"])
+            for stream in response.data.get("streams", [])
         ]
+        self.cache.set(key, streams, RESULT_TTL if streams else EMPTY_RESULT_TTL)
+        return streams
 
-    match (item.type):
-        case "movie":
-            pattern = r"^(?:(?!Season|Episode|Collection|S\d{1,2}|E\d{1,2}).)*$"
-            return len(re.findall(pattern, file, re.IGNORECASE)) > 0
-        case "season":
-            return len(match_folder(folder)) > 0
-        case "episode":
-            if len(match_folder(folder)) == 0:
-                return False
-            pattern = r"(S\d{1,2}|Season \d{1,2}).*(E\d{1,2}|Episode \d{1,2})"
-            return len(re.findall(pattern, file, re.IGNORECASE)) > 0
-        case _:
+
+@lru_cache(maxsize=65536)
+def _aired_at_timestamp(aired_at: str) -> float:
+    if aired_at is None:
+        return None
+    return datetime.strptime(aired_at, "%Y-%m-%d:%H").timestamp()
+
+
+def _latest_aired_at(item: MediaItem) -> float:
+    """Latest air date of item, for seasons the latest aired episode"""
+    if item.type != "season":
+        return _aired_at_timestamp(item.aired_at) or 0
+    now = datetime.now().timestamp()
+    return max(
+        (
+            aired_at
+            for aired_at in (
+                _aired_at_timestamp(episode.aired_at) for episode in item.episodes
+            )
+            if aired_at is not None and aired_at <= now
+        ),
+        default=_aired_at_timestamp(item.aired_at) or 0,
+    )
+
+
+def _rescrape_interval(item: MediaItem) -> float:
+    """Seconds to wait after the last scrape of item before the next one
+
+    Doubles with every scrape in a row that found nothing, up to a week, and
+    starts over when something aired since the last scrape."""
+    if item.scrape_attempts <= 1 or _latest_aired_at(item) > item.scraped_at:
+        return RESCRAPE_INTERVAL
+    # Same jitter for the item and attempt across restarts, spreads out retries
+    jitter = random.Random(
+        f"{_item_identifier(item)}:{item.scrape_attempts}"
+    ).uniform(-1, 1)
+    return min(
+        RESCRAPE_INTERVAL
+        * 2 ** (item.scrape_attempts - 1)
+        * (1 + RESCRAPE_JITTER * jitter),
+        MAX_RESCRAPE_INTERVAL,
+    )
+
+
+def _item_identifier(item: MediaItem) -> str:
+    """Identifier of item that stays the same across restarts"""
+    item_type = item.type
+    numbers = []
+    while item.parent is not None:
+        numbers.append(str(item.number))
+        item = item.parent
+    return ":".join([str(item.imdb_id), item_type, *reversed(numbers)])
+
+
+def _is_tracked(item: MediaItem, media_items: MediaItemContainer) -> bool:
+    """True if item is still part of media_items
+
+    Library matching replaces seasons and episodes with other objects, the
+    replaced ones keep their parent but are no longer among its children."""
+    while item.parent is not None:
+        parent = item.parent
+        if parent.type == "show":
+            children = parent.loaded_seasons
+        else:
+            children = parent.episodes
+        if not any(child is item for child in children):
             return False
+        item = parent
+    return media_items.get_item("imdb_id", item.imdb_id) is item
 
 
-def _matches_rclone_formatting(item, file, folder) -> bool:
-    matching_string = file
+def _log_string(item: MediaItem) -> str:
     match (item.type):
-        case "movie":
-            pattern = r"(19|20)([0-9]{2} ?\.?)"
+        case "season":
+            return f"{item.parent.title} season {item.number}"
+        case "episode":
+            return f"{item.parent.parent.title} season {item.parent.number} episode {item.number}"
         case _:
-            pattern = r"(S[0-9]{2}|SEASON|COMPLETE|[^457a-z\W\s]-[0-9]+)"
-            matching_string = folder
-
-    return len(re.findall(pattern, matching_string, re.IGNORECASE)) > 0
+            return item.title
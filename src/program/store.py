@@ -0,0 +1,291 @@
+"""Media store module"""
+import os
+import pickle
+import sqlite3
+import threading
+from functools import partial
+from utils.logger import logger
+from utils.thread import ThreadRunner
+from program.media import (
+    Episode,
+    MediaItem,
+    MediaItemContainer,
+    MediaItemState,
+    Movie,
+    Season,
+    Show,
+)
+
+
+ITEM_CLASSES = {"movie": Movie, "show": Show, "season": Season, "episode": Episode}
+CHILDREN_ATTRIBUTES = {"show": "seasons", "season": "episodes"}
+NOT_STORED_ATTRIBUTES = [
+    "_store_id",
+    "_dirty",
+    "_dirty_children",
+    "parent",
+    "seasons",
+    "episodes",
+    "_seasons",
+    "_seasons_loader",
+    "_summary_state",
+    "current_state",
+]
+
+
+class MediaStore:
+    """SQLite backed media item store
+
+    Every media item is stored in its own row, children reference their parent
+    row. Shows that are fully in the library are loaded without their seasons,
+    those are read from the database when first accessed. save() only
+    serializes the items marked dirty since the last save and queues the rows,
+    a background thread writes queued rows in one transaction at most once
+    every `flush_interval` seconds."""
+
+    def __init__(self, filename, flush_interval=10):
+        self.filename = filename
+        self.version = 0
+        self.flushed_version = 0
+        self._lock = threading.Lock()
+        self._connection_lock = threading.Lock()
+        self._pending = []
+        self._root_ids = set()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = FULL;
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                position INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                imdb_id TEXT,
+                state TEXT,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS items_parent_id ON items (parent_id);
+            """
+        )
+        self._next_id = (
+            self._connection.execute("SELECT MAX(id) FROM items").fetchone()[0] or 0
+        ) + 1
+        self._writer = ThreadRunner(self.flush, flush_interval)
+        self._writer.start()
+
+    def load(self, container: MediaItemContainer):
+        """Load all stored items into container"""
+        with self._connection_lock:
+            rows = self._connection.execute(
+                "WITH RECURSIVE loaded (id) AS ("
+                " SELECT id FROM items WHERE parent_id IS NULL"
+                " AND NOT (type = 'show' AND state = ?)"
+                " UNION ALL"
+                " SELECT items.id FROM items JOIN loaded ON items.parent_id = loaded.id"
+                ") SELECT id, parent_id, type, state, data FROM items"
+                " WHERE parent_id IS NULL OR id IN loaded"
+                " ORDER BY parent_id, position, id",
+                (MediaItemState.LIBRARY.name,),
+            ).fetchall()
+        if not rows:
+            self._load_legacy(container)
+            return
+
+        roots = self._items_from_rows(rows, None)
+        library_ids = {
+            item_id
+            for item_id, parent_id, item_type, state, _ in rows
+            if parent_id is None
+            and item_type == "show"
+            and state == MediaItemState.LIBRARY.name
+        }
+        for item in roots:
+            if item._store_id in library_ids:
+                item.defer_seasons(
+                    partial(self._load_children, item._store_id),
+                    MediaItemState.LIBRARY,
+                )
+        self._root_ids = {item._store_id for item in roots}
+        container.items = roots
+        logger.info("Loaded %s items from %s", len(roots), self.filename)
+
+    def _load_children(self, parent_id) -> list[MediaItem]:
+        with self._connection_lock:
+            rows = self._connection.execute(
+                "WITH RECURSIVE loaded (id) AS ("
+                " SELECT id FROM items WHERE parent_id = ?"
+                " UNION ALL"
+                " SELECT items.id FROM items JOIN loaded ON items.parent_id = loaded.id"
+                ") SELECT id, parent_id, type, state, data FROM items"
+                " WHERE id IN loaded ORDER BY parent_id, position, id",
+                (parent_id,),
+            ).fetchall()
+        return self._items_from_rows(rows, parent_id)
+
+    def _items_from_rows(self, rows, parent_id) -> list[MediaItem]:
+        """Build items from rows and return the ones under parent_id"""
+        items = {
+            item_id: _item_from_row(item_id, item_type, data)
+            for item_id, _, item_type, _, data in rows
+        }
+        top_items = []
+        for item_id, item_parent_id, _, _, _ in rows:
+            item = items[item_id]
+            if item_parent_id == parent_id:
+                top_items.append(item)
+                continue
+            parent = items.get(item_parent_id)
+            if parent is None:
+                continue
+            item.parent = parent
+            getattr(parent, CHILDREN_ATTRIBUTES[parent.type]).append(item)
+        return top_items
+
+    def _load_legacy(self, container: MediaItemContainer):
+        """Import items from the pickle file used before the store existed"""
+        legacy_filename = os.path.splitext(self.filename)[0] + ".pkl"
+        if os.path.exists(legacy_filename):
+            container.load(legacy_filename)
+            logger.info("Imported %s items from %s", len(container), legacy_filename)
+
+    def save(self, container: MediaItemContainer):
+        """Queue items changed since last save and removed items for writing"""
+        operations = []
+        root_ids = set()
+        for position, item in enumerate(container):
+            if item is None:
+                continue
+            self._save_item(item, None, position, operations)
+            root_ids.add(item._store_id)
+        for item_id in self._root_ids - root_ids:
+            operations.append(("delete", item_id))
+        self._root_ids = root_ids
+        if operations:
+            with self._lock:
+                self._pending += operations
+                self.version += 1
+
+    def _save_item(self, item: MediaItem, parent_id, position, operations):
+        match item.type:
+            case "show":
+                # Seasons are only read back from the store, so deferred
+                # seasons are loaded before the show is stored the first time
+                children = (
+                    item.seasons if item._store_id is None else item.loaded_seasons
+                )
+            case "season":
+                children = item.episodes
+            case _:
+                children = []
+        if item._dirty or item._store_id is None:
+            if item._store_id is None:
+                item._store_id = self._next_id
+                self._next_id += 1
+            elif item.type == "season" or item.type == "show" and item.seasons_loaded:
+                operations.append(
+                    ("prune", item._store_id, [child._store_id for child in children])
+                )
+            operations.append(
+                (
+                    "upsert",
+                    item._store_id,
+                    parent_id,
+                    position,
+                    item.type,
+                    item.imdb_id,
+                    item.state.name,
+                    _serialize_item(item),
+                )
+            )
+            item._dirty = False
+            for child_position, child in enumerate(children):
+                self._save_item(child, item._store_id, child_position, operations)
+        elif item._dirty_children:
+            operations.append(("state", item.state.name, item._store_id))
+            for child_position, child in enumerate(children):
+                self._save_item(child, item._store_id, child_position, operations)
+        item._dirty_children = False
+
+    def flush(self):
+        """Write queued rows to the database in one transaction"""
+        with self._lock:
+            operations, self._pending = self._pending, []
+            version = self.version
+        if not operations:
+            return
+        try:
+            self._write(operations)
+        except sqlite3.Error:
+            # The transaction was rolled back, keep the changes for the next flush
+            logger.error("Failed to write changes to %s", self.filename, exc_info=True)
+            with self._lock:
+                self._pending = operations + self._pending
+            return
+        self.flushed_version = version
+        logger.debug("Wrote %s changes to %s", len(operations), self.filename)
+
+    def _write(self, operations):
+        with self._connection_lock, self._connection:
+            for operation, *values in operations:
+                match operation:
+                    case "upsert":
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO items"
+                            " (id, parent_id, position, type, imdb_id, state, data)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            values,
+                        )
+                    case "state":
+                        self._connection.execute(
+                            "UPDATE items SET state = ? WHERE id = ?", values
+                        )
+                    case "prune":
+                        parent_id, keep_ids = values
+                        keep_ids = [item_id for item_id in keep_ids if item_id]
+                        self._delete_items(
+                            "parent_id = ? AND id NOT IN"
+                            f" ({', '.join('?' * len(keep_ids))})",
+                            (parent_id, *keep_ids),
+                        )
+                    case "delete":
+                        self._delete_items("id = ?", values)
+
+    def _delete_items(self, condition, parameters):
+        """Delete matching items together with all their children"""
+        self._connection.execute(
+            "WITH RECURSIVE deleted (id) AS ("
+            f" SELECT id FROM items WHERE {condition}"
+            " UNION ALL"
+            " SELECT items.id FROM items JOIN deleted ON items.parent_id = deleted.id"
+            ") DELETE FROM items WHERE id IN deleted",
+            parameters,
+        )
+
+    def close(self):
+        """Stop the background writer, write queued rows and close the database"""
+        self._writer.stop()
+        self.flush()
+        with self._connection_lock:
+            self._connection.close()
+
+
+def _serialize_item(item: MediaItem) -> bytes:
+    data = {
+        key: value
+        for key, value in item.__getstate__().items()
+        if key not in NOT_STORED_ATTRIBUTES
+    }
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _item_from_row(item_id, item_type, data) -> MediaItem:
+    item_class = ITEM_CLASSES[item_type]
+    item = item_class.__new__(item_class)
+    item.__setstate__(pickle.loads(data))
+    if item_type in CHILDREN_ATTRIBUTES:
+        setattr(item, CHILDREN_ATTRIBUTES[item_type], [])
+    item._store_id = item_id
+    item._dirty = False
+    item._dirty_children = False
+    return item
@@ -1,5 +1,6 @@
 """Trakt updater module"""
 from datetime import datetime
+from functools import partial
 from utils.logger import logger
 from utils.request import get
 from program.media import (
@@ -28,13 +29,14 @@ class Updater:
         new_items = MediaItemContainer()
         get_items = MediaItemContainer()
         for imdb_id in imdb_ids:
-            if imdb_id not in [item.imdb_id for item in self.trakt_data.items if item]:
+            existing_item = self.trakt_data.get_item("imdb_id", imdb_id)
+            if not existing_item:
                 item = self._create_item(imdb_id)
                 if item:
                     new_items += item
                 get_items.append(item)
             else:
-                get_items.append(self.trakt_data.get_item("imdb_id", imdb_id))
+                get_items.append(existing_item)
         added_items = self.trakt_data.extend(new_items)
         if len(added_items) > 0:
             for added_item in added_items:
@@ -47,37 +49,43 @@ class Updater:
     def _create_item(self, imdb_id):
         item = create_item_from_imdb_id(imdb_id)
         if item and item.type == "show":
-            seasons = get_show(imdb_id)
-            for season in seasons:
-                if season.number != 0:
-                    new_season = _map_item_from_data(season, "season")
-                    for episode in season.episodes:
-                        new_episode = _map_item_from_data(episode, "episode")
-                        new_season.add_episode(new_episode)
-                    item.add_season(new_season)
+            item.defer_seasons(partial(_create_seasons, imdb_id))
         return item
 
 
+def _create_seasons(imdb_id) -> list[Season]:
+    """Create seasons with episodes of show from trakt.tv"""
+    seasons = []
+    for season in get_show(imdb_id):
+        if season["number"] != 0:
+            new_season = _map_item_from_data(season, "season")
+            for episode in season.get("episodes") or []:
+                new_episode = _map_item_from_data(episode, "episode")
+                new_season.add_episode(new_episode)
+            seasons.append(new_season)
+    return seasons
+
+
 def _map_item_from_data(data, item_type):
     """Map trakt.tv API data to MediaItemContainer"""
     formatted_aired_at = None
-    if getattr(data, "first_aired", None):
-        aired_at = data.first_aired
+    if data.get("first_aired"):
+        aired_at = data["first_aired"]
         formatted_aired_at = datetime.strptime(
             aired_at, "%Y-%m-%dT%H:%M:%S.%fZ"
         ).strftime("%Y-%m-%d:%H")
-    if getattr(data, "released", None):
-        released_at = data.released
+    if data.get("released"):
+        released_at = data["released"]
         formatted_aired_at = datetime.strptime(released_at, "%Y-%m-%d").strftime(
             "%Y-%m-%d:%H"
         )
     item = {
         "state": MediaItemState.CONTENT,
-        "title": getattr(data, "title", None),
-        "year": getattr(data, "year", None),
-        "imdb_id": getattr(data.ids, "imdb", None),
+        "title": data.get("title"),
+        "year": data.get("year"),
+        "imdb_id": data["ids"].get("imdb"),
         "aired_at": formatted_aired_at,
-        "genres": getattr(data, "genres", None),
+        "genres": data.get("genres"),
     }
     match item_type:
         case "movie":
@@ -85,10 +93,10 @@ def _map_item_from_data(data, item_type):
         case "show":
             return_item = Show(item)
         case "season":
-            item["number"] = getattr(data, "number")
+            item["number"] = data["number"]
             return_item = Season(item)
         case "episode":
-            item["number"] = getattr(data, "number")
+            item["number"] = data["number"]
             return_item = Episode(item)
         case _:
             return_item = None
@@ -104,6 +112,8 @@ def get_show(imdb_id: str):
     response = get(
         url,
         additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID},
+        response_type=dict,
+        cache_ttl=60 * 60 * 12,
     )
     if response.is_ok:
         if response.data:
@@ -117,14 +127,16 @@ def create_item_from_imdb_id(imdb_id: str):
     response = get(
         url,
         additional_headers={"trakt-api-version": "2", "trakt-api-key": CLIENT_ID},
+        response_type=dict,
+        cache_ttl=60 * 60 * 24,
     )
     if response.is_ok:
         if len(response.data) > 0:
-            media_type = response.data[0].type
+            media_type = response.data[0]["type"]
             if media_type == "movie":
-                data = response.data[0].movie
+                data = response.data[0]["movie"]
             else:
-                data = response.data[0].show
+                data = response.data[0]["show"]
             if data:
                 return _map_item_from_data(data, media_type)
     return None
@@ -0,0 +1,107 @@
+"""Persistent cache module"""
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple
+
+
+class CacheEntry(NamedTuple):
+    """Cached value and the time it expires at"""
+
+    value: Any
+    expires_at: float
+
+    @property
+    def is_expired(self) -> bool:
+        """True if the entry is past its time to live"""
+        return self.expires_at <= time.time()
+
+
+class DiskCache:
+    """SQLite backed key value cache
+
+    Entries stay in the database after they expire so callers can revalidate
+    them. Every `EVICT_EVERY` writes the least recently used entries above
+    `max_entries` are evicted."""
+
+    EVICT_EVERY = 100
+
+    def __init__(self, filename, max_entries=10000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+            """
+        )
+
+    def get(self, key: str) -> CacheEntry:
+        """Get entry for key, expired or not, None if there is none"""
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return CacheEntry(pickle.loads(row[0]), row[1])
+
+    def set(self, key: str, value, ttl: float):
+        """Store value for key for ttl seconds"""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, data, now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def touch(self, key: str, ttl: float):
+        """Extend the lifetime of key by ttl seconds from now"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE entries SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                (now + ttl, now, key),
+            )
+
+    def delete(self, key: str):
+        """Remove key from the cache"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+
+    def _evict(self):
+        self._connection.execute(
+            "DELETE FROM entries WHERE key IN ("
+            " SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.max_entries,),
+        )
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,140 @@
+"""Request metrics module"""
+import re
+import threading
+from urllib.parse import urlsplit
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+IMDB_ID_PATTERN = re.compile(r"^tt\d+(?::\d+)*")
+HASH_PATTERN = re.compile(r"^[0-9a-fA-F]{32,40}$")
+ID_PATTERN = re.compile(r"^(?=.*\d)[\w-]{6,}$|^\d+$")
+
+
+def normalize_route(path: str) -> str:
+    """Replace ids, hashes and options in url path with placeholders"""
+    segments = []
+    for segment in path.split("/"):
+        if IMDB_ID_PATTERN.match(segment):
+            segment = IMDB_ID_PATTERN.sub("{imdb_id}", segment)
+        elif HASH_PATTERN.match(segment):
+            if segments and segments[-1] == "{hashes}":
+                continue
+            segment = "{hashes}"
+        elif "=" in segment:
+            segment = "{options}"
+        elif ID_PATTERN.match(segment):
+            segment = "{id}"
+        segments.append(segment)
+    return "/".join(segments)
+
+
+class _EndpointMetrics:
+    __slots__ = (
+        "requests",
+        "latency_sum",
+        "latency_max",
+        "latency_buckets",
+        "bytes",
+        "retries",
+        "cache_hits",
+        "statuses",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.bytes = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.statuses = {}
+
+
+class RequestMetrics:
+    """Latency, size, retry and status counters per host and route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._waits = {}
+
+    def _endpoint(self, method: str, url: str) -> _EndpointMetrics:
+        parsed_url = urlsplit(url)
+        key = (parsed_url.netloc, method, normalize_route(parsed_url.path))
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = _EndpointMetrics()
+        return endpoint
+
+    def record_request(
+        self, method: str, url: str, status, elapsed: float, size: int, retries=0
+    ):
+        """Record one request sent to the server"""
+        with self._lock:
+            endpoint = self._endpoint(method, url)
+            endpoint.requests += 1
+            endpoint.latency_sum += elapsed
+            endpoint.latency_max = max(endpoint.latency_max, elapsed)
+            for index, bucket in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bucket:
+                    endpoint.latency_buckets[index] += 1
+                    break
+            endpoint.bytes += size
+            endpoint.retries += retries
+            endpoint.statuses[status] = endpoint.statuses.get(status, 0) + 1
+
+    def record_cache_hit(self, method: str, url: str):
+        """Record a request answered from the response cache"""
+        with self._lock:
+            self._endpoint(method, url).cache_hits += 1
+
+    def record_wait(self, host: str, elapsed: float):
+        """Record time spent waiting for the rate limiters of host"""
+        with self._lock:
+            count, total, longest = self._waits.get(host, (0, 0.0, 0.0))
+            self._waits[host] = (count + 1, total + elapsed, max(longest, elapsed))
+
+    def snapshot(self) -> dict:
+        """Current metrics as plain data"""
+        with self._lock:
+            requests = [
+                {
+                    "host": host,
+                    "method": method,
+                    "route": route,
+                    "requests": endpoint.requests,
+                    "latency": {
+                        "sum": endpoint.latency_sum,
+                        "max": endpoint.latency_max,
+                        "buckets": {
+                            str(bucket): count
+                            for bucket, count in zip(
+                                LATENCY_BUCKETS, endpoint.latency_buckets
+                            )
+                        },
+                    },
+                    "bytes": endpoint.bytes,
+                    "retries": endpoint.retries,
+                    "cache_hits": endpoint.cache_hits,
+                    "statuses": {
+                        str(status): count
+                        for status, count in endpoint.statuses.items()
+                    },
+                }
+                for (host, method, route), endpoint in self._endpoints.items()
+            ]
+            waits = {
+                host: {"count": count, "sum": total, "max": longest}
+                for host, (count, total, longest) in self._waits.items()
+            }
+        return {"requests": requests, "rate_limiter_waits": waits}
+
+    def reset(self):
+        """Clear all recorded metrics"""
+        with self._lock:
+            self._endpoints.clear()
+            self._waits.clear()
+
+
+request_metrics = RequestMetrics()
@@ -1,22 +1,57 @@
 """Requests wrapper"""
+import asyncio
+import base64
+import collections
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import hashlib
+import io
 import json
 import logging
-from multiprocessing import Lock
+import threading
 import time
 from types import SimpleNamespace
+from urllib.parse import urlsplit
+import weakref
 import requests
 from lxml import etree
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 import xmltodict
+from utils.cache import DiskCache
+from utils.metrics import request_metrics
 
 logger = logging.getLogger(__name__)
 
 _retry_strategy = Retry(
     total=5,
     status_forcelist=[500, 502, 503, 504],
+    respect_retry_after_header=False,
 )
-_adapter = HTTPAdapter(max_retries=_retry_strategy)
+_pool_connections = 10
+_pool_maxsize = 10
+_sessions = {}
+_sessions_lock = threading.Lock()
+_max_concurrency = 20
+_max_concurrency_per_host = 10
+_semaphores = weakref.WeakKeyDictionary()
+_async_in_flight = weakref.WeakKeyDictionary()
+_executor = None
+_response_cache = None
+_rate_limiters = {}
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_host_overrides = {}
+_recording = None
+_recording_lock = threading.Lock()
+_replay = None
+_max_rate_limit_retries = 3
+_max_rate_limit_delay = 60
+# Budget of the limiter created for hosts without one when they answer 429
+_adaptive_max_calls = 10
+_adaptive_period = 1
 
 
 class ResponseObject:
@@ -35,7 +70,7 @@ class ResponseObject:
             logger.warning("Error: %s %s", response.status_code, response.content)
         if self.status_code not in [200, 201, 204]:
             if self.status_code == 429:
-                raise requests.exceptions.RequestException(response.content)
+                raise RateLimitExceeded(response.content)
             return {}
         if len(response.content) > 0:
             if "handler error" not in response.text:
@@ -68,24 +103,384 @@ def _make_request(
     additional_headers=None,
     retry_if_failed=True,
     response_type=SimpleNamespace,
+    cache_ttl=None,
+    rate_limited=True,
 ) -> ResponseObject:
-    session = requests.Session()
-    if retry_if_failed:
-        session.mount("http://", _adapter)
-        session.mount("https://", _adapter)
+    headers = _request_headers(additional_headers)
+    fetch = partial(
+        _fetch,
+        method,
+        url,
+        headers,
+        data,
+        timeout,
+        retry_if_failed,
+        cache_ttl,
+        rate_limited,
+    )
+    if method == "GET":
+        response = _coalesce((url, tuple(sorted(headers.items()))), fetch)
+    else:
+        response = fetch()
+    return ResponseObject(response, response_type)
+
+
+def _request_headers(additional_headers) -> dict:
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
     if additional_headers:
         headers.update(additional_headers)
+    return headers
+
+
+def _coalesce(key, fetch) -> requests.Response:
+    """Run fetch once for concurrent callers with the same key
 
+    Callers share the response and decode it on their own, so one caller
+    changing its data does not affect the others."""
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _in_flight[key] = SimpleNamespace(
+                event=threading.Event(), response=None, error=None
+            )
+    if not is_leader:
+        call.event.wait()
+        if call.error:
+            raise call.error
+        return call.response
     try:
-        response = session.request(
-            method, url, headers=headers, data=data, timeout=timeout
+        call.response = fetch()
+    except Exception as exception:
+        call.error = exception
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.event.set()
+    return call.response
+
+
+def _fetch(
+    method,
+    url,
+    headers,
+    data,
+    timeout,
+    retry_if_failed,
+    cache_ttl,
+    rate_limited,
+    stream=False,
+) -> requests.Response:
+    """Send request, answering from cache and waiting for host rate limiters
+
+    With stream the body is left unread, streamed responses are not cached."""
+    session = _get_session(url, retry_if_failed)
+    cache = _response_cache if cache_ttl and method == "GET" and not stream else None
+    entry = None
+    if cache:
+        cache_key = _cache_key(method, url, headers)
+        entry = cache.get(cache_key)
+        if entry and not entry.is_expired:
+            request_metrics.record_cache_hit(method, url)
+            return _cached_response(url, entry.value)
+        if entry:
+            headers.update(_revalidation_headers(entry.value))
+
+    host = urlsplit(url).netloc
+    limiters = _rate_limiters.get(host, ())
+    for attempt in range(_max_rate_limit_retries + 1):
+        if limiters and (rate_limited or attempt > 0):
+            _raise_if_blocked(host, limiters)
+            start_time = time.monotonic()
+            for limiter in limiters:
+                limiter.acquire()
+            request_metrics.record_wait(host, time.monotonic() - start_time)
+        start_time = time.monotonic()
+        try:
+            response = _send(session, method, url, headers, data, timeout, stream)
+        except requests.RequestException:
+            request_metrics.record_request(
+                method, url, "error", time.monotonic() - start_time, 0, attempt > 0
+            )
+            response = _handle_request_exception()
+            break
+        request_metrics.record_request(
+            method,
+            url,
+            response.status_code,
+            time.monotonic() - start_time,
+            _response_size(response),
+            (attempt > 0) + _urllib3_retries(response),
         )
-    except requests.RequestException:
-        response = _handle_request_exception()
+        delay = _rate_limit_delay(response)
+        if response.status_code != 429:
+            for limiter in limiters:
+                limiter.recover()
+                if delay:
+                    limiter.backoff(delay, slow_down=False)
+            break
+        delay = delay or 2**attempt
+        if not limiters:
+            # Start limiting the host, so the backoff slows down every caller
+            limiters = [
+                get_rate_limiter(host, _adaptive_max_calls, _adaptive_period)
+            ]
+        if delay > _max_rate_limit_delay or attempt == _max_rate_limit_retries:
+            # Pause the host for as long as the server asked before giving up
+            for limiter in limiters:
+                limiter.backoff(delay)
+            raise RateLimitExceeded(
+                f"Rate limited by {urlsplit(url).netloc}, retry after {delay:.0f}s"
+            )
+        logger.debug("Rate limited by %s, retrying in %.1fs", url, delay)
+        response.close()
+        for limiter in limiters:
+            limiter.backoff(delay)
 
-    session.close()
-    return ResponseObject(response, response_type)
+    if cache:
+        if entry and response.status_code == 304:
+            cache.touch(cache_key, cache_ttl)
+            response = _cached_response(url, entry.value)
+        elif response.status_code == 200:
+            cache.set(
+                cache_key,
+                {
+                    "headers": dict(response.headers),
+                    "encoding": response.encoding,
+                    "content": response.content,
+                },
+                cache_ttl,
+            )
+    return response
+
+
+def _raise_if_blocked(host: str, limiters):
+    """Raise RateLimitExceeded if a limiter of host is paused for too long to wait"""
+    delay = max(limiter.blocked_until for limiter in limiters) - time.monotonic()
+    if delay > _max_rate_limit_delay:
+        raise RateLimitExceeded(f"Rate limited by {host}, retry after {delay:.0f}s")
+
+
+def _send(
+    session, method, url, headers, data, timeout, stream=False
+) -> requests.Response:
+    """Send request, or answer it from the replayed recording"""
+    if _replay is not None:
+        return _replayed_response(method, url)
+    parsed_url = urlsplit(url)
+    request_url = url
+    if parsed_url.netloc in _host_overrides:
+        request_url = _host_overrides[parsed_url.netloc].rstrip("/") + url.split(
+            parsed_url.netloc, 1
+        )[1]
+    response = session.request(
+        method, request_url, headers=headers, data=data, timeout=timeout, stream=stream
+    )
+    if _recording is not None:
+        _record(method, url, response)
+    return response
+
+
+def _record(method: str, url: str, response: requests.Response):
+    line = json.dumps(
+        {
+            "method": method,
+            "url": url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "content": base64.b64encode(response.content).decode(),
+        }
+    )
+    with _recording_lock:
+        _recording.write(line + "\n")
+        _recording.flush()
+
+
+def _replayed_response(method: str, url: str) -> requests.Response:
+    with _recording_lock:
+        recorded = _replay.get((method, url))
+        if recorded:
+            # Answer repeated requests in recorded order, repeating the last one
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+    response = requests.Response()
+    response.url = url
+    if not recorded:
+        logger.warning("No recorded response for %s %s", method, url)
+        response.status_code = 404
+        response._content = b""
+        response._content_consumed = True
+        return response
+    response.status_code = entry["status_code"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = base64.b64decode(entry["content"])
+    response._content_consumed = True
+    return response
+
+
+def set_host_overrides(overrides: dict):
+    """Send requests for the given hosts to other base urls, like local stubs"""
+    global _host_overrides
+    _host_overrides = dict(overrides)
+
+
+def enable_recording(filename: str):
+    """Append every response received from now on to filename"""
+    global _recording
+    with _recording_lock:
+        if _recording is not None:
+            _recording.close()
+        _recording = open(filename, "a", encoding="utf-8")
+
+
+def enable_replay(filename: str):
+    """Answer requests from responses recorded in filename instead of sending them"""
+    global _replay
+    replay = {}
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            replay.setdefault(
+                (entry["method"], entry["url"]), collections.deque()
+            ).append(entry)
+    with _recording_lock:
+        _replay = replay
+
+
+def disable_record_replay():
+    """Stop recording and replaying responses"""
+    global _recording, _replay
+    with _recording_lock:
+        if _recording is not None:
+            _recording.close()
+        _recording = None
+        _replay = None
+
+
+def _response_size(response: requests.Response) -> int:
+    if response._content is False:
+        # Streamed body that was not read yet
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content)
+
+
+def _urllib3_retries(response: requests.Response) -> int:
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries else 0
+
+
+def _rate_limit_delay(response: requests.Response) -> float:
+    """Seconds the server asked to wait before the next request, if any"""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            return max(
+                parsedate_to_datetime(retry_after).timestamp() - time.time(), 0
+            )
+        except (TypeError, ValueError):
+            pass
+    remaining = response.headers.get(
+        "X-RateLimit-Remaining", response.headers.get("RateLimit-Remaining")
+    )
+    reset = response.headers.get(
+        "X-RateLimit-Reset", response.headers.get("RateLimit-Reset")
+    )
+    if remaining == "0" and reset:
+        try:
+            reset = float(reset)
+        except ValueError:
+            return None
+        # Reset is either an epoch timestamp or seconds from now
+        return max(reset - time.time(), 0) if reset > 1e9 else reset
+    return None
+
+
+def _cache_key(method: str, url: str, headers: dict) -> str:
+    header_hash = hashlib.sha1(repr(sorted(headers.items())).encode()).hexdigest()
+    return f"{method} {url} {header_hash}"
+
+
+def _revalidation_headers(cached: dict) -> dict:
+    headers = {}
+    if "ETag" in cached["headers"]:
+        headers["If-None-Match"] = cached["headers"]["ETag"]
+    if "Last-Modified" in cached["headers"]:
+        headers["If-Modified-Since"] = cached["headers"]["Last-Modified"]
+    return headers
+
+
+def _cached_response(url: str, cached: dict) -> requests.Response:
+    """Rebuild response from cached headers and content"""
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.headers = CaseInsensitiveDict(cached["headers"])
+    response.encoding = cached["encoding"]
+    response._content = cached["content"]
+    return response
+
+
+def enable_cache(filename: str, max_entries=10000):
+    """Store responses of get calls made with cache_ttl in filename"""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = DiskCache(filename, max_entries)
+
+
+def _get_session(url: str, retry_if_failed: bool) -> requests.Session:
+    """Get the pooled session for the host of url, creating it on first use"""
+    parsed_url = urlsplit(url)
+    key = (parsed_url.scheme, parsed_url.netloc, retry_if_failed)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            adapter = HTTPAdapter(
+                pool_connections=_pool_connections,
+                pool_maxsize=_pool_maxsize,
+                max_retries=_retry_strategy if retry_if_failed else 0,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def metered_session() -> requests.Session:
+    """Session for clients with their own HTTP calls, like plexapi
+
+    Its responses are recorded in the request metrics."""
+    session = requests.Session()
+    session.hooks["response"].append(_record_response_metrics)
+    return session
+
+
+def _record_response_metrics(response: requests.Response, *args, **kwargs):
+    if not kwargs.get("stream"):
+        # Read now, the session would right after the hook anyway
+        response.content
+    request_metrics.record_request(
+        response.request.method,
+        response.url,
+        response.status_code,
+        response.elapsed.total_seconds(),
+        _response_size(response),
+        _urllib3_retries(response),
+    )
+
+
+def configure_pool(pool_connections=10, pool_maxsize=10):
+    """Set connection pool sizes of the per host sessions"""
+    global _pool_connections, _pool_maxsize
+    with _sessions_lock:
+        _pool_connections = pool_connections
+        _pool_maxsize = pool_maxsize
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
 
 
 def get(
@@ -94,8 +489,9 @@ def get(
     additional_headers=None,
     retry_if_failed=True,
     response_type=SimpleNamespace,
+    cache_ttl=None,
 ) -> ResponseObject:
-    """Requests get wrapper"""
+    """Requests get wrapper, cache_ttl caches the response for that many seconds"""
     return _make_request(
         "GET",
         url,
@@ -103,6 +499,7 @@ def get(
         additional_headers=additional_headers,
         retry_if_failed=retry_if_failed,
         response_type=response_type,
+        cache_ttl=cache_ttl,
     )
 
 
@@ -138,18 +535,200 @@ def put(
     )
 
 
+async def _make_request_async(
+    method: str,
+    url: str,
+    data: dict = None,
+    timeout=5,
+    additional_headers=None,
+    retry_if_failed=True,
+    response_type=SimpleNamespace,
+    cache_ttl=None,
+) -> ResponseObject:
+    """Run request on the shared executor, limited per event loop and host
+
+    Concurrent GET tasks with the same key share one request, only that one
+    waits for the host rate limiters."""
+    loop = asyncio.get_running_loop()
+    headers = _request_headers(additional_headers)
+    fetch = partial(
+        _fetch,
+        method,
+        url,
+        headers,
+        data,
+        timeout,
+        retry_if_failed,
+        cache_ttl,
+        False,
+    )
+    if method != "GET":
+        response = await _run_async(loop, url, fetch)
+        return ResponseObject(response, response_type)
+
+    key = (url, tuple(sorted(headers.items())))
+    with _sessions_lock:
+        in_flight = _async_in_flight.setdefault(loop, {})
+    task = in_flight.get(key)
+    if task is None:
+        # Also coalesced with threads requesting the same url
+        task = in_flight[key] = loop.create_task(
+            _run_async(loop, url, partial(_coalesce, key, fetch))
+        )
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    response = await asyncio.shield(task)
+    return ResponseObject(response, response_type)
+
+
+async def _run_async(loop, url: str, fetch) -> requests.Response:
+    """Wait for the semaphores and rate limiters of host, then run fetch"""
+    host = urlsplit(url).netloc
+    async with _get_semaphore(loop, None, _max_concurrency), _get_semaphore(
+        loop, host, _max_concurrency_per_host
+    ):
+        limiters = _rate_limiters.get(host, ())
+        if limiters:
+            _raise_if_blocked(host, limiters)
+            start_time = time.monotonic()
+            for limiter in limiters:
+                await limiter.acquire_async()
+            request_metrics.record_wait(host, time.monotonic() - start_time)
+        return await loop.run_in_executor(_get_executor(), fetch)
+
+
+def _get_semaphore(loop, host, limit) -> asyncio.Semaphore:
+    with _sessions_lock:
+        semaphores = _semaphores.setdefault(loop, {})
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(limit)
+        return semaphores[host]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _sessions_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_max_concurrency, thread_name_prefix="request"
+            )
+        return _executor
+
+
+def configure_async(max_concurrency=20, max_concurrency_per_host=10):
+    """Set how many async requests can run at once in total and per host"""
+    global _max_concurrency, _max_concurrency_per_host, _executor
+    with _sessions_lock:
+        _max_concurrency = max_concurrency
+        _max_concurrency_per_host = max_concurrency_per_host
+        _semaphores.clear()
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+async def async_get(
+    url: str,
+    timeout=10,
+    additional_headers=None,
+    retry_if_failed=True,
+    response_type=SimpleNamespace,
+    cache_ttl=None,
+) -> ResponseObject:
+    """Async requests get wrapper"""
+    return await _make_request_async(
+        "GET",
+        url,
+        timeout=timeout,
+        additional_headers=additional_headers,
+        retry_if_failed=retry_if_failed,
+        response_type=response_type,
+        cache_ttl=cache_ttl,
+    )
+
+
+async def async_post(
+    url: str, data: dict, timeout=10, additional_headers=None, retry_if_failed=False
+) -> ResponseObject:
+    """Async requests post wrapper"""
+    return await _make_request_async(
+        "POST",
+        url,
+        data=data,
+        timeout=timeout,
+        additional_headers=additional_headers,
+        retry_if_failed=retry_if_failed,
+    )
+
+
+async def async_put(
+    url: str,
+    data: dict = None,
+    timeout=10,
+    additional_headers=None,
+    retry_if_failed=False,
+) -> ResponseObject:
+    """Async requests put wrapper"""
+    return await _make_request_async(
+        "PUT",
+        url,
+        data=data,
+        timeout=timeout,
+        additional_headers=additional_headers,
+        retry_if_failed=retry_if_failed,
+    )
+
+
+def stream_xml(url: str, tag: str, timeout=10, additional_headers=None):
+    """Yield tag elements of xml response as they are parsed
+
+    Parsed elements are released after they are yielded, so large responses
+    like Plex library listings never have to be held in memory as a whole."""
+    headers = {"Accept": "application/xml"}
+    if additional_headers:
+        headers.update(additional_headers)
+    response = _fetch("GET", url, headers, None, timeout, True, None, True, stream=True)
+    if not response.ok:
+        logger.warning("Error: %s %s", response.status_code, response.content)
+        return
+    try:
+        if response._content is False:
+            response.raw.decode_content = True
+            source = response.raw
+        else:
+            # Already read by the recorder or replayed
+            source = response.content
+        yield from iter_xml(source, tag)
+    finally:
+        response.close()
+
+
+def iter_xml(source, tag: str):
+    """Yield tag elements of xml bytes or file object as SimpleNamespaces"""
+    if isinstance(source, (bytes, str)):
+        source = io.BytesIO(source.encode() if isinstance(source, str) else source)
+    for _, element in etree.iterparse(source, events=("end",), tag=tag):
+        yield _element_to_simplenamespace(element)
+        # Drop the element and already handled siblings to keep memory flat
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
 def _xml_to_simplenamespace(xml_string):
-    root = etree.fromstring(xml_string)
+    return _element_to_simplenamespace(etree.fromstring(xml_string))
 
-    def element_to_simplenamespace(element):
-        children_as_ns = {
-            child.tag: element_to_simplenamespace(child) for child in element
-        }
-        attributes = {key: value for key, value in element.attrib.items()}
-        attributes.update(children_as_ns)
-        return SimpleNamespace(**attributes, text=element.text)
 
-    return element_to_simplenamespace(root)
+def _element_to_simplenamespace(element):
+    """Convert element to SimpleNamespace
+
+    Child elements are held in a list per tag, also when a tag occurs once,
+    so a container with a single item has the same shape as a larger one."""
+    children = {}
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        children.setdefault(child.tag, []).append(_element_to_simplenamespace(child))
+    return SimpleNamespace(**{**element.attrib, **children}, text=element.text)
 
 
 class RateLimitExceeded(Exception):
@@ -157,38 +736,148 @@ class RateLimitExceeded(Exception):
 
 
 class RateLimiter:
+    """Token bucket rate limiter
+
+    Tokens refill continuously at `max_calls` per `period` seconds up to
+    `max_calls`. Threads and async tasks waiting for a token are served in
+    arrival order. With `raise_on_limit` RateLimitExceeded is raised instead of
+    waiting when the tokens are used up.
+
+    backoff() pauses the limiter when the server pushes back and halves the
+    refill rate, recover() raises it again step by step on successful
+    requests."""
+
     def __init__(self, max_calls, period, raise_on_limit=False):
         self.max_calls = max_calls
         self.period = period
-        self.tokens = max_calls
-        self.last_call = (
-            time.time() - period
-        )  # Initialize as if the last call was a "period" ago
-        self.lock = Lock()
         self.raise_on_limit = raise_on_limit
+        self.max_rate = max_calls / period
+        self.rate = self.max_rate
+        self.tokens = max_calls
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self._condition = threading.Condition()
+        self._waiters = collections.deque()
 
-    def __enter__(self):
-        with self.lock:
-            current_time = time.time()
-            time_since_last_call = current_time - self.last_call
-
-            # Refill tokens only if the entire period has elapsed
-            if time_since_last_call >= self.period:
-                self.tokens = self.max_calls
-
-            if self.tokens < 1:
-                if self.raise_on_limit:
-                    raise RateLimitExceeded("Rate limit exceeded!")
-                time_to_sleep = self.period - time_since_last_call
-                time.sleep(time_to_sleep)
-                # After sleeping, update the last_call to account for the time we just waited
-                self.last_call = current_time + time_to_sleep
-            else:
-                # If we had enough tokens, just consume one and update the last call
-                self.tokens -= 1
-                self.last_call = current_time
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.max_calls, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def _take(self, ticket=None) -> float:
+        """Take a token if ticket is first in line, else return seconds to wait"""
+        self._refill()
+        first_in_line = (
+            self._waiters[0] is ticket if self._waiters else ticket is None
+        )
+        wait_time = max(self.blocked_until - self.updated_at, 0)
+        if self.tokens < 1:
+            wait_time = max(wait_time, (1 - self.tokens) / self.rate)
+        if first_in_line and wait_time == 0:
+            self.tokens -= 1
+            return 0
+        return wait_time or 1 / self.rate
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now"""
+        with self._condition:
+            return self._take() == 0
+
+    def acquire(self, timeout=None) -> bool:
+        """Take a token, waiting up to timeout seconds for one"""
+        with self._condition:
+            if self._take() == 0:
+                return True
+            if self.raise_on_limit and self.tokens < 1:
+                raise RateLimitExceeded("Rate limit exceeded!")
+            deadline = None if timeout is None else time.monotonic() + timeout
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    wait_time = self._take(ticket)
+                    if wait_time == 0:
+                        return True
+                    if self._waiters[0] is not ticket:
+                        wait_time = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait_time = min(wait_time or remaining, remaining)
+                    self._condition.wait(wait_time)
+            finally:
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+
+    async def acquire_async(self):
+        """Take a token without blocking the event loop"""
+        with self._condition:
+            if self._take() == 0:
+                return
+            if self.raise_on_limit and self.tokens < 1:
+                raise RateLimitExceeded("Rate limit exceeded!")
+            ticket = object()
+            self._waiters.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    wait_time = self._take(ticket)
+                if wait_time == 0:
+                    return
+                await asyncio.sleep(wait_time)
+        finally:
+            with self._condition:
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+
+    def backoff(self, delay: float, slow_down=True):
+        """Pause for delay seconds, halving the refill rate if slow_down"""
+        with self._condition:
+            self._refill()
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            if slow_down:
+                # Keep one token so a single request probes the server first
+                self.tokens = min(self.tokens, 1)
+                self.rate = max(self.rate / 2, self.max_rate / 32)
+            self._condition.notify_all()
 
+    def recover(self):
+        """Raise refill rate back towards its maximum after a success"""
+        if self.rate < self.max_rate:
+            with self._condition:
+                self._refill()
+                self.rate = min(self.rate + self.max_rate / 10, self.max_rate)
+
+    def __enter__(self):
+        self.acquire()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         pass
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+def get_rate_limiter(
+    host: str, max_calls, period, raise_on_limit=False
+) -> RateLimiter:
+    """Get the limiter shared by all requests to host for period
+
+    The limiter is created on first use, requests to host wait for every
+    limiter registered for it."""
+    with _sessions_lock:
+        limiters = _rate_limiters.setdefault(host, [])
+        for limiter in limiters:
+            if limiter.period == period:
+                return limiter
+        limiter = RateLimiter(max_calls, period, raise_on_limit)
+        limiters.append(limiter)
+        return limiter
@@ -0,0 +1,498 @@
+"""Local stand-in servers for offline load testing
+
+StubServer answers the Torrentio, Real-Debrid, Trakt, Overseerr, mdblist and
+Plex endpoints the program calls with generated data. Point the program at it
+with `set_host_overrides(server.host_overrides())` and set the Overseerr url
+and Plex address settings to `server.url`."""
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.etree import ElementTree
+
+
+STUBBED_HOSTS = {
+    "torrentio.strem.fun": "torrentio",
+    "api.real-debrid.com": "realdebrid",
+    "api.trakt.tv": "trakt",
+    "www.mdblist.com": "mdblist",
+}
+RESOLUTIONS = ["2160p", "1080p", "720p", "480p"]
+SEASONS_PER_SHOW = 3
+EPISODES_PER_SEASON = 10
+# Plex rating keys of seasons and episodes are offset from those of their show
+SEASON_KEY_OFFSET = 10**8
+EPISODE_KEY_OFFSET = 2 * 10**8
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server emulating the upstream services
+
+    Every response is delayed by `latency` seconds, `error_rate` of the
+    requests fail with 500 and each service answers 429 with Retry-After once
+    it got more than `max_calls` requests in `period` seconds.
+
+    The Plex library holds `library_ratio` of the movies and shows numbered
+    up to `library_items`, the last season of a show only half aired."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port=0,
+        latency=0.0,
+        error_rate=0.0,
+        max_calls=None,
+        period=1,
+        streams_per_item=30,
+        cached_ratio=0.5,
+        requested_items=100,
+        library_items=100,
+        library_ratio=0.5,
+        seed=0,
+    ):
+        super().__init__(("localhost", port), _StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_calls = max_calls
+        self.period = period
+        self.streams_per_item = streams_per_item
+        self.cached_ratio = cached_ratio
+        self.requested_items = requested_items
+        self.library_items = library_items
+        self.library_ratio = library_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.titles = {}
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """Base url of the server"""
+        return f"http://localhost:{self.server_address[1]}"
+
+    def host_overrides(self) -> dict:
+        """Host override map that sends all stubbed hosts to this server"""
+        return {host: self.url for host in STUBBED_HOSTS}
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+    def rate_limit_delay(self, service: str) -> float:
+        """Seconds until service accepts requests again, 0 if it does now"""
+        if not self.max_calls:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            calls = [call for call in self.calls.get(service, []) if call > now - self.period]
+            if len(calls) >= self.max_calls:
+                self.calls[service] = calls
+                return calls[0] + self.period - now
+            calls.append(now)
+            self.calls[service] = calls
+        return 0
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        parsed_url = urlsplit(self.path)
+        for route_method, pattern, service, handler in ROUTES:
+            match = pattern.match(parsed_url.path)
+            if route_method == method and match:
+                break
+        else:
+            self._send(404, {"error": "unknown endpoint"})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+        delay = server.rate_limit_delay(service)
+        if delay:
+            self._send(429, {"error": "too many requests"}, {"Retry-After": str(math.ceil(delay))})
+            return
+        with server.lock:
+            failed = server.random.random() < server.error_rate
+        if failed:
+            self._send(500, {"error": "stub failure"})
+            return
+        status, body = handler(server, parse_qs(parsed_url.query), *match.groups())
+        self._send(status, body)
+
+    def _send(self, status, body, headers=None):
+        if isinstance(body, bytes):
+            content, content_type = body, "text/xml;charset=utf-8"
+        else:
+            content = json.dumps(body).encode() if body is not None else b""
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _item_random(*keys) -> random.Random:
+    """Random generator that gives the same data for the same item every time"""
+    return random.Random(hashlib.sha1(":".join(map(str, keys)).encode()).digest())
+
+
+def _torrentio_streams(server, _, scrape_type, imdb_id, season, episode):
+    item_random = _item_random(imdb_id, season, episode)
+    name = f"Title.{imdb_id}"
+    streams = []
+    for index in range(server.streams_per_item):
+        resolution = item_random.choice(RESOLUTIONS)
+        group = f"GRP{index}"
+        if scrape_type == "movie":
+            folder = f"{name}.{2000 + int(imdb_id[2:]) % 24}.{resolution}.BluRay.x264-{group}"
+            file = f"{folder}.mkv"
+        elif index % 3 == 0:
+            folder = f"{name}.S{int(season):02d}.{resolution}.WEB.x264-{group}"
+            file = f"{name}.S{int(season):02d}E01.{resolution}.WEB.x264-{group}.mkv"
+        else:
+            folder = f"{name}.S{int(season):02d}E{int(episode):02d}.{resolution}.WEB.x264-{group}"
+            file = f"{folder}.mkv"
+        info_hash = hashlib.sha1(folder.encode()).hexdigest()
+        with server.lock:
+            server.titles[info_hash] = folder
+        title = folder if folder == file[:-4] else f"{folder}\n{file}"
+        seeds = item_random.randint(0, 500)
+        size = item_random.randint(5, 500) / 10
+        streams.append(
+            {
+                "name": f"Torrentio\n{resolution}",
+                "title": f"{title}\n👤 {seeds} 💾 {size} GB ⚙️ Stub",
+                "infoHash": info_hash,
+            }
+        )
+    return 200, {"streams": streams}
+
+
+def _instant_availability(server, _, hashes):
+    availability = {}
+    for info_hash in hashes.strip("/").split("/"):
+        with server.lock:
+            folder = server.titles.get(info_hash)
+        if not folder or _item_random(info_hash).random() >= server.cached_ratio:
+            availability[info_hash] = []
+            continue
+        season = re.search(r"\.S(\d{2})\.", folder)
+        if season:
+            filenames = [
+                folder.replace(f".S{season.group(1)}.", f".S{season.group(1)}E{episode:02d}.") + ".mkv"
+                for episode in range(1, EPISODES_PER_SEASON + 1)
+            ]
+        else:
+            filenames = [f"{folder}.mkv"]
+        container = {
+            str(file_id): {"filename": filename, "filesize": 1500000000}
+            for file_id, filename in enumerate(filenames, 1)
+        }
+        availability[info_hash] = {"rd": [container]}
+    return 200, availability
+
+
+def _add_magnet(server, _):
+    with server.lock:
+        torrent_id = f"STUB{server.random.randrange(16**8):08X}"
+    return 201, {"id": torrent_id, "uri": f"https://api.real-debrid.com/rest/1.0/torrents/info/{torrent_id}"}
+
+
+def _select_files(*_):
+    return 204, None
+
+
+def _torrent_info(_, __, torrent_id):
+    return 200, {"id": torrent_id, "status": "downloaded", "progress": 100, "files": []}
+
+
+def _trakt_item(imdb_id):
+    number = int(imdb_id[2:] or 0)
+    item = {
+        "title": f"Title {imdb_id}",
+        "year": 2000 + number % 24,
+        "ids": {"imdb": imdb_id},
+        "genres": ["drama"],
+    }
+    if number % 2:
+        item["first_aired"] = f"{item['year']}-01-01T00:00:00.000Z"
+        return {"type": "show", "show": item}
+    item["released"] = f"{item['year']}-01-01"
+    return {"type": "movie", "movie": item}
+
+
+def _trakt_search(_, __, imdb_id):
+    return 200, [_trakt_item(imdb_id)]
+
+
+def _trakt_seasons(_, __, imdb_id):
+    year = _trakt_item(imdb_id)["show"]["year"]
+    seasons = []
+    for season in range(SEASONS_PER_SHOW + 1):
+        episodes = [
+            {
+                "number": episode,
+                "title": f"Episode {episode}",
+                "ids": {"imdb": None},
+                "first_aired": f"{year + season}-01-{episode:02d}T00:00:00.000Z",
+            }
+            for episode in range(1, EPISODES_PER_SEASON + 1)
+        ]
+        seasons.append(
+            {
+                "number": season,
+                "ids": {},
+                "first_aired": episodes[0]["first_aired"],
+                "episodes": episodes,
+            }
+        )
+    return 200, seasons
+
+
+def _overseerr_requests(server, query):
+    amount = min(int(query.get("take", ["20"])[0]), server.requested_items)
+    results = [
+        {"media": {"imdbId": None, "mediaType": "tv" if number % 2 else "movie", "tmdbId": number, "tvdbId": number}}
+        for number in range(1, amount + 1)
+    ]
+    return 200, {"results": results}
+
+
+def _overseerr_media(_, __, ___, external_id):
+    return 200, {"title": f"Title tt{external_id}", "externalIds": {"imdbId": f"tt{external_id}"}}
+
+
+def _mdblist_user(*_):
+    return 200, {"limits": {"api_requests": 100000}}
+
+
+def _mdblist_items(server, _, list_id):
+    return 200, [{"imdb_id": f"tt{int(list_id) * 1000 + number}"} for number in range(server.requested_items)]
+
+
+def _xml(element_tag, children=(), **attributes) -> ElementTree.Element:
+    element = ElementTree.Element(
+        element_tag, {key: str(value) for key, value in attributes.items()}
+    )
+    element.extend(children)
+    return element
+
+
+def _media_container(children=(), **attributes) -> bytes:
+    children = list(children)
+    container = _xml("MediaContainer", children, size=len(children), **attributes)
+    return ElementTree.tostring(container, encoding="utf-8")
+
+
+def _library_numbers(server, item_type) -> list:
+    """Numbers of the movies or shows in the library, shows are odd like in trakt"""
+    return [
+        number
+        for number in range(1, server.library_items + 1)
+        if number % 2 == (item_type == "show")
+        and _item_random("plex", number).random() < server.library_ratio
+    ]
+
+
+def _plex_item(number) -> ElementTree.Element:
+    trakt_item = _trakt_item(f"tt{number}")
+    item_type = trakt_item["type"]
+    data = trakt_item[item_type]
+    children = [_xml("Genre", tag=genre) for genre in data["genres"]]
+    children.append(_xml("Guid", id=f"imdb://{data['ids']['imdb']}"))
+    attributes = {
+        "ratingKey": number,
+        "type": item_type,
+        "title": data["title"],
+        "year": data["year"],
+        "guid": f"plex://{item_type}/{number}",
+        "originallyAvailableAt": f"{data['year']}-01-01",
+        "art": f"/library/metadata/{number}/art/0",
+        "addedAt": 0,
+    }
+    if item_type == "movie":
+        file = f"/movies/Title.tt{number}.{data['year']}.1080p.BluRay.x264-GRP0.mkv"
+        children.append(_xml("Media", [_xml("Part", file=file)]))
+        return _xml("Video", children, key=f"/library/metadata/{number}", **attributes)
+    children.append(_xml("Location", path=f"/shows/Title tt{number}"))
+    return _xml(
+        "Directory", children, key=f"/library/metadata/{number}/children", **attributes
+    )
+
+
+def _plex_season(number, season) -> ElementTree.Element:
+    rating_key = SEASON_KEY_OFFSET + number * 100 + season
+    return _xml(
+        "Directory",
+        ratingKey=rating_key,
+        key=f"/library/metadata/{rating_key}/children",
+        parentRatingKey=number,
+        parentTitle=f"Title tt{number}",
+        type="season",
+        title=f"Season {season}",
+        index=season,
+        originallyAvailableAt=f"{_trakt_item(f'tt{number}')['show']['year'] + season}-01-01",
+        art=f"/library/metadata/{number}/art/0",
+        addedAt=0,
+    )
+
+
+def _plex_episodes(number, season) -> list:
+    year = _trakt_item(f"tt{number}")["show"]["year"]
+    episodes = EPISODES_PER_SEASON
+    if season == SEASONS_PER_SHOW:
+        episodes //= 2
+    return [
+        _xml(
+            "Video",
+            [
+                _xml(
+                    "Media",
+                    [
+                        _xml(
+                            "Part",
+                            file=f"/shows/Title tt{number}/Season {season}/"
+                            f"Title.tt{number}.S{season:02d}E{episode:02d}.1080p.WEB.x264-GRP1.mkv",
+                        )
+                    ],
+                )
+            ],
+            ratingKey=EPISODE_KEY_OFFSET + number * 10000 + season * 100 + episode,
+            key=f"/library/metadata/{EPISODE_KEY_OFFSET + number * 10000 + season * 100 + episode}",
+            parentRatingKey=SEASON_KEY_OFFSET + number * 100 + season,
+            grandparentRatingKey=number,
+            grandparentTitle=f"Title tt{number}",
+            parentTitle=f"Season {season}",
+            type="episode",
+            title=f"Episode {episode}",
+            index=episode,
+            parentIndex=season,
+            originallyAvailableAt=f"{year + season}-01-{episode:02d}",
+            art=f"/library/metadata/{number}/art/0",
+            addedAt=0,
+        )
+        for episode in range(1, episodes + 1)
+    ]
+
+
+def _plex_server(server, _):
+    return 200, _media_container(
+        friendlyName="Stub", machineIdentifier="stub", version="1.40.0.0"
+    )
+
+
+def _plex_library(*_):
+    return 200, _media_container(title1="Plex Library")
+
+
+def _plex_sections(*_):
+    return 200, _media_container(
+        [
+            _xml("Directory", key=1, type="movie", title="Movies", agent="tv.plex.agents.movie", refreshing=0),
+            _xml("Directory", key=2, type="show", title="TV Shows", agent="tv.plex.agents.series", refreshing=0),
+        ]
+    )
+
+
+def _plex_section_items(server, _, section_id):
+    item_type = "movie" if section_id == "1" else "show"
+    return 200, _media_container(
+        (_plex_item(number) for number in _library_numbers(server, item_type)),
+        librarySectionID=section_id,
+    )
+
+
+def _plex_section_refresh(*_):
+    return 200, None
+
+
+def _plex_metadata(_, __, rating_key):
+    rating_key = int(rating_key)
+    if rating_key >= EPISODE_KEY_OFFSET:
+        number, rest = divmod(rating_key - EPISODE_KEY_OFFSET, 10000)
+        season, episode = divmod(rest, 100)
+        return 200, _media_container(_plex_episodes(number, season)[episode - 1: episode])
+    if rating_key >= SEASON_KEY_OFFSET:
+        number, season = divmod(rating_key - SEASON_KEY_OFFSET, 100)
+        return 200, _media_container([_plex_season(number, season)])
+    return 200, _media_container([_plex_item(rating_key)])
+
+
+def _plex_children(_, __, rating_key):
+    rating_key = int(rating_key)
+    if rating_key >= SEASON_KEY_OFFSET:
+        number, season = divmod(rating_key - SEASON_KEY_OFFSET, 100)
+        return 200, _media_container(_plex_episodes(number, season))
+    return 200, _media_container(
+        _plex_season(rating_key, season) for season in range(1, SEASONS_PER_SHOW + 1)
+    )
+
+
+def _plex_agents(*_):
+    return 200, _media_container(
+        _xml("Agent", identifier=identifier, name=identifier)
+        for identifier in ["tv.plex.agents.movie", "tv.plex.agents.series"]
+    )
+
+
+def _plex_matches(*_):
+    return 200, _media_container()
+
+
+ROUTES = [
+    ("GET", re.compile(r"^/[^/]*/stream/(movie|show)/(tt\d+)(?::(\d+):(\d+))?\.json$"), "torrentio", _torrentio_streams),
+    ("GET", re.compile(r"^/rest/1\.0/torrents/instantAvailability/(.+)$"), "realdebrid", _instant_availability),
+    ("POST", re.compile(r"^/rest/1\.0/torrents/addMagnet$"), "realdebrid", _add_magnet),
+    ("POST", re.compile(r"^/rest/1\.0/torrents/selectFiles/(\w+)$"), "realdebrid", _select_files),
+    ("GET", re.compile(r"^/rest/1\.0/torrents/info/(\w+)$"), "realdebrid", _torrent_info),
+    ("GET", re.compile(r"^/search/imdb/(tt\d+)$"), "trakt", _trakt_search),
+    ("GET", re.compile(r"^/shows/(tt\d+)/seasons$"), "trakt", _trakt_seasons),
+    ("GET", re.compile(r"^/api/v1/request$"), "overseerr", _overseerr_requests),
+    ("GET", re.compile(r"^/api/v1/(movie|tv)/(\d+)$"), "overseerr", _overseerr_media),
+    ("GET", re.compile(r"^/api/user$"), "mdblist", _mdblist_user),
+    ("GET", re.compile(r"^/api/lists/(\d+)/items$"), "mdblist", _mdblist_items),
+    ("GET", re.compile(r"^/$"), "plex", _plex_server),
+    ("GET", re.compile(r"^/library/?$"), "plex", _plex_library),
+    ("GET", re.compile(r"^/library/sections/?$"), "plex", _plex_sections),
+    ("GET", re.compile(r"^/library/sections/(\d+)/all$"), "plex", _plex_section_items),
+    ("GET", re.compile(r"^/library/sections/(\d+)/refresh$"), "plex", _plex_section_refresh),
+    ("GET", re.compile(r"^/library/metadata/(\d+)$"), "plex", _plex_metadata),
+    ("GET", re.compile(r"^/library/metadata/(\d+)/children$"), "plex", _plex_children),
+    ("GET", re.compile(r"^/library/metadata/(\d+)/matches$"), "plex", _plex_matches),
+    ("GET", re.compile(r"^/system/agents$"), "plex", _plex_agents),
+]
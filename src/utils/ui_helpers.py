@@ -1,7 +1,21 @@
 """Ui helpers"""
-from types import SimpleNamespace
+from types import MappingProxyType, SimpleNamespace
 from flask.json import JSONEncoder
-from program.media import MediaItem, MediaItemState
+from program.media import MediaItem, MediaItemState, Show, Stream
+
+
+NOT_ENCODED_ATTRIBUTES = [
+    "_containers",
+    "_state",
+    "_state_generation",
+    "_store_id",
+    "_dirty",
+    "_dirty_children",
+    "parent",
+    "_seasons",
+    "_seasons_loader",
+    "_summary_state",
+]
 
 
 class CustomJSONEncoder(JSONEncoder):
@@ -9,10 +23,21 @@ class CustomJSONEncoder(JSONEncoder):
 
     def default(self, o):
         if isinstance(o, MediaItem):
-            attributes = {k: v for k, v in o.__dict__.items() if k not in ["_lock", "parent"]}
+            attributes = {k: getattr(o, k) for k in o if k not in NOT_ENCODED_ATTRIBUTES}
+            attributes["current_state"] = o.state.name
+            if o.imdb_id:
+                attributes["imdb_link"] = o.imdb_link
+            if isinstance(o, Show):
+                attributes["seasons"] = o.loaded_seasons
+            return attributes
+        if isinstance(o, Stream):
+            attributes = {k: getattr(o, k) for k in o.__slots__}
+            attributes["files"] = [file._asdict() for file in o.files]
             return attributes
         if isinstance(o, MediaItemState):
             return o.name
+        if isinstance(o, MappingProxyType):
+            return dict(o)
         if isinstance(o, SimpleNamespace):
             return o.__dict__
         return super().default(o)